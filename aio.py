@@ -0,0 +1,188 @@
+import asyncio
+import json
+
+from time import monotonic
+from typing import TYPE_CHECKING, Any, Coroutine, Dict, List, TypeVar
+
+import aiohttp
+import aiosmtplib
+
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+import config
+import emailer
+from exceptions import SheetUnavailable, SheetUnreadable
+from groupme import TIMEOUT
+from models.SheetLoader import SHEETS_TIMEOUT, GoogleClient, GoogleSheetLoader, missing_tab, outage_status
+
+if TYPE_CHECKING:
+    from gspread import Client
+
+
+# Connections held open per host by the shared HTTP pool
+HTTP_POOL_SIZE = 100
+SHEETS_VALUES_URL = "https://sheets.googleapis.com/v4/spreadsheets/{}/values:batchGet"
+
+T = TypeVar("T")
+
+
+class HTTPResponse:
+    """The parts of requests.Response that the bot's callers use."""
+
+    def __init__(self, status_code: int, headers: Any, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode(errors="replace")
+
+    def json(self) -> Any:
+        return json.loads(self.content)
+
+
+class LoopIO:
+    """The event loop and HTTP pool that every outbound call shares in asyncio mode.
+
+    The sync parts of the bot (command handlers, the outbox and mail workers)
+    run on other threads and hand their I/O to the loop with call(), so a slow
+    GroupMe, Sheets or SMTP server ties up a coroutine rather than a process."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.session: aiohttp.ClientSession | None = None
+
+    async def open(self):
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_SIZE))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    def call(self, coro: Coroutine[Any, Any, T]) -> T:
+        """Run coro on the loop and wait for it. Only for threads other than the loop's own."""
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            coro.close()
+            raise RuntimeError("LoopIO.call() would block the event loop; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def fetch(
+            self,
+            method: str,
+            url: str,
+            timeout: float | tuple = TIMEOUT,
+            **kwargs: Any
+        ) -> HTTPResponse:
+        connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        assert self.session is not None, "LoopIO.open() was not awaited"
+        async with self.session.request(
+                method, url, timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+                **kwargs) as resp:
+            return HTTPResponse(resp.status, resp.headers, await resp.read())
+
+
+class LoopTransport:
+    """A requests.Session stand-in for GroupMeClient that sends through the loop's pool."""
+
+    def __init__(self, io: LoopIO):
+        self.io = io
+
+    def request(self, method: str, url: str, **kwargs: Any) -> HTTPResponse:
+        try:
+            return self.io.call(self.io.fetch(method, url, **kwargs))
+        except aiohttp.ConnectionTimeoutError as e:
+            raise ConnectTimeout(f"{method} {url} timed out connecting") from e
+        except aiohttp.ClientConnectorError as e:
+            # Never connected, so nothing was sent; GroupMeClient may retry even a POST
+            raise ConnectionError(NewConnectionError(None, str(e))) from e  # type: ignore
+        except aiohttp.ClientConnectionError as e:
+            # Raised as requests' errors so GroupMeClient's retry policy still applies
+            raise ConnectionError(str(e)) from e
+        except asyncio.TimeoutError as e:
+            raise Timeout(f"{method} {url} timed out") from e
+
+
+class LoopSheetLoader(GoogleSheetLoader):
+    """GoogleSheetLoader whose batched values request goes out over the loop's pool."""
+
+    def __init__(self, io: LoopIO):
+        self.io = io
+
+    def _batch_get(self, gc: "Client", spreadsheet_id: str, ranges: List[str]) -> Dict[str, Any] | None:
+        headers = {"Authorization": f"Bearer {GoogleClient.get_instance().access_token()}"}
+        try:
+            resp = self.io.call(self.io.fetch(
+                "GET", SHEETS_VALUES_URL.format(spreadsheet_id), timeout=SHEETS_TIMEOUT,
+                params=[("ranges", value_range) for value_range in ranges], headers=headers))
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            raise SheetUnavailable(f"Could not reach Google Sheets: {e!r}") from e
+        if resp.ok:
+            return resp.json()
+        try:
+            message = resp.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = resp.text
+        if missing_tab(resp.status_code, message):
+            return None
+        if outage_status(resp.status_code):
+            raise SheetUnavailable(f"Google Sheets answered {resp.status_code}: {message}")
+        raise SheetUnreadable(f"Google Sheets answered {resp.status_code}: {message}")
+
+
+class LoopSMTPConnection:
+    """Drop-in for emailer's SMTP connection that talks to the server from the event loop."""
+
+    def __init__(self, io: LoopIO):
+        self.io = io
+        self._client: aiosmtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    def send(self, address_list: List[str], message: str):
+        self.io.call(self.send_async(address_list, message))
+
+    def close(self):
+        self.io.call(self.close_async())
+
+    async def send_async(self, address_list: List[str], message: str):
+        if self._client is not None and monotonic() - self._last_used > emailer.SMTP_IDLE_TIMEOUT:
+            await self.close_async()
+        try:
+            await (await self._connected()).sendmail(config.FROM_ADDRESS, address_list, message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # The server hung up between sends; one fresh connection is worth a try
+            await self.close_async()
+            await (await self._connected()).sendmail(config.FROM_ADDRESS, address_list, message)
+        self._last_used = monotonic()
+
+    async def close_async(self):
+        if self._client is None:
+            return
+        try:
+            await self._client.quit()
+        except (aiosmtplib.SMTPException, OSError):
+            pass
+        self._client = None
+
+    async def _connected(self) -> aiosmtplib.SMTP:
+        if self._client is None:
+            client = aiosmtplib.SMTP(
+                hostname=config.SMTP_SERVER, port=config.SMTP_PORT,
+                timeout=emailer.SMTP_TIMEOUT, start_tls=False)
+            await client.connect()
+            if config.get("SMTP_STARTTLS", True):
+                await client.starttls()
+            if config.get("SMTP_USERNAME"):
+                await client.login(config.SMTP_USERNAME, config.get("SMTP_PASSWORD", ""))
+            self._client = client
+        return self._client
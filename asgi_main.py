@@ -0,0 +1,195 @@
+import asyncio
+import json
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, Tuple
+from urllib.parse import parse_qs
+
+import emailer
+from aio import LoopIO, LoopSheetLoader, LoopSMTPConnection, LoopTransport
+from command_queue import Command, run as run_command
+from groupme import GroupMeClient
+from main import prepare, start_background_work
+from metrics import QUEUE_DEPTH, WEBHOOK_SECONDS, render
+from models.Sheet import Sheet
+from routes import accept_event, complete_oauth, release_event
+from storage import flush
+
+
+# Threads running the sync command handlers; they mostly wait on the loop's I/O
+COMMAND_THREADS = 32
+# Commands accepted but not finished before callbacks get a 503
+MAX_PENDING_COMMANDS = 256
+
+Scope = Dict[str, Any]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Response = Tuple[str, int]
+
+
+class CommandRunner:
+    """Adapter that runs the existing sync command handlers off the event loop."""
+
+    def __init__(self, threads: int = COMMAND_THREADS, max_pending: int = MAX_PENDING_COMMANDS):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="command")
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def submit(self, command: Command) -> bool:
+        """Start the command unless too many are already pending. Call from the loop."""
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        future = self._executor.submit(run_command, *command)
+        future.add_done_callback(lambda f: self._loop.call_soon_threadsafe(self._finished, f))  # type: ignore
+        return True
+
+    def _finished(self, future: Future):
+        self.pending -= 1
+        error = future.exception()
+        if error is not None:
+            print(f"[ERROR] Command failed: {error!r}")
+
+
+_commands = CommandRunner()
+_io: LoopIO | None = None
+_smtp: LoopSMTPConnection | None = None
+QUEUE_DEPTH.set_function(lambda: _commands.pending, queue="commands")
+
+
+async def healthcheck(scope: Scope, body: bytes) -> Response:
+    return "ok", 200
+
+
+async def metrics(scope: Scope, body: bytes) -> Response:
+    return render(), 200
+
+
+async def callback(scope: Scope, body: bytes) -> Response:
+    return "ok", 200
+
+
+async def new_event(scope: Scope, body: bytes) -> Response:
+    start = perf_counter()
+    outcome = "error"
+    try:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            outcome = "invalid"
+            return "Invalid JSON", 400
+        # Dedupe and logging are quick SQLite calls, but they can wait on a lock
+        outcome, command = await asyncio.to_thread(accept_event, data)
+        if command and not _commands.submit(command):
+            print(f"[ERROR] Dropping command from {command[2]}: {_commands.pending} commands pending")
+            await asyncio.to_thread(release_event, data, command)
+            outcome = "busy"
+            return "busy", 503
+        return "ok", 200
+    finally:
+        WEBHOOK_SECONDS.observe(perf_counter() - start, outcome=outcome)
+
+
+async def oauth_callback(scope: Scope, body: bytes) -> Response:
+    args = {key: values[0] for key, values in parse_qs(scope["query_string"].decode()).items()}
+    return await asyncio.to_thread(
+        complete_oauth, args.get("state", ""), args.get("access_token"), args.get("code"))
+
+
+ROUTES: Dict[Tuple[str, str], Callable[[Scope, bytes], Awaitable[Response]]] = {
+    ("GET", "/healthcheck"): healthcheck,
+    ("GET", "/metrics"): metrics,
+    ("POST", "/new_event"): new_event,
+    ("GET", "/"): callback,
+    ("POST", "/"): callback,
+    ("GET", "/oauth/callback"): oauth_callback,
+}
+CONTENT_TYPES = {"/metrics": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+async def app(scope: Scope, receive: Receive, send: Send):
+    """ASGI application serving the same routes as the Flask app in routes.py."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    handler = ROUTES.get((scope["method"], scope["path"]))
+    if handler is None:
+        allowed = any(path == scope["path"] for _, path in ROUTES)
+        await _send(send, 405 if allowed else 404, "Method Not Allowed" if allowed else "Not Found")
+        return
+
+    text, status = await handler(scope, await _read_body(receive))
+    await _send(send, status, text, CONTENT_TYPES.get(scope["path"], "text/html; charset=utf-8"))
+
+
+async def startup():
+    """main.py's lifecycle hooks, plus routing outbound I/O through the loop."""
+    global _io, _smtp
+    prepare()
+
+    loop = asyncio.get_running_loop()
+    _commands.bind(loop)
+    _io = LoopIO(loop)
+    await _io.open()
+    GroupMeClient._instance = GroupMeClient(transport=LoopTransport(_io))  # type: ignore
+    Sheet._instance = Sheet(loader=LoopSheetLoader(_io))
+    _smtp = LoopSMTPConnection(_io)
+    emailer.use_connection(_smtp)  # type: ignore
+
+    start_background_work()
+
+
+async def shutdown():
+    flush()
+    if _smtp is not None:
+        await _smtp.close_async()
+    if _io is not None:
+        await _io.close()
+
+
+async def _lifespan(receive: Receive, send: Send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await startup()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": repr(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def _read_body(receive: Receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _send(send: Send, status: int, text: str, content_type: str = "text/plain; charset=utf-8"):
+    body = text.encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="0.0.0.0", port=5001)
@@ -0,0 +1,773 @@
+import argparse
+import json
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, perf_counter, sleep
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from requests import PreparedRequest, Response, Session
+from requests.adapters import BaseAdapter
+
+
+DEFAULT_REQUESTS = 2000
+DEFAULT_CONCURRENCY = 16
+# Schedule rows in the generated fixture workbook
+DEFAULT_SHEET_ROWS = 500
+DEFAULT_PEOPLE = 60
+# A result is a regression when it is this much worse than the baseline
+DEFAULT_TOLERANCE = 0.25
+# Iterations of each in-process micro benchmark
+MICRO_ITERATIONS = 200
+# Each command is replayed this many times when counting its outbound calls
+COMMAND_REPEATS = 3
+# Round trip added to each stubbed Sheets API request (seconds)
+DEFAULT_SHEETS_LATENCY = 0.05
+# Workbook reads per Sheets loading strategy
+SHEET_READ_REPEATS = 5
+# Snapshot builds (and upcoming-event lookups) timed per strategy; the best run is reported
+SHEET_BUILD_REPEATS = 3
+# Message rows written per storage write strategy and thread count
+STORAGE_WRITES = 2000
+STORAGE_WRITE_THREADS = [1, 4]
+# How long to wait for background sends to finish after a command
+DRAIN_TIMEOUT = 30.0
+# A fresh process must answer /healthcheck and queue the /ping reply within this
+# many ms of starting to import main (interpreter start-up not included)
+STARTUP_BUDGET_MS = 400.0
+# Cold starts measured; the median is reported
+STARTUP_RUNS = 3
+# Imported by the first command that needs them, never on the way to /ping
+LAZY_MODULES = ["gspread", "google.oauth2", "smtplib", "croniter", "pytz", "requests"]
+
+# Synthetic traffic: mostly chatter, some commands, and a few GroupMe redeliveries
+LOAD_COMMANDS = ["/ping", "/hello", "/help", "/echo hi", "/schedule", "/schedule show 5"]
+COMMAND_SHARE = 0.2
+DUPLICATE_SHARE = 0.05
+# Commands whose outbound calls are counted one at a time
+COUNTED_COMMANDS = LOAD_COMMANDS + ["/schedule email", "/calendar"]
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_NAME = "Bench Bot"
+GROUP_ID = "bench-group"
+DEFAULT_GROUPS = 1
+SHEET_URL = "https://docs.google.com/spreadsheets/d/bench/edit"
+
+Payload = Dict[str, Any]
+
+
+class GroupMeStub:
+    """Local stand-in for the GroupMe API that answers every call with success and counts them."""
+
+    def __init__(self):
+        self.calls: "Counter[str]" = Counter()
+        self._lock = threading.Lock()
+        self._events = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                stub._handle(self)
+
+            def do_DELETE(self):
+                stub._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def _handle(self, handler: BaseHTTPRequestHandler):
+        length = int(handler.headers.get("Content-Length") or 0)
+        handler.rfile.read(length)
+        endpoint = _endpoint(handler.path)
+        with self._lock:
+            self.calls[endpoint] += 1
+            self._events += 1
+            event_id = f"event-{self._events}"
+
+        body = {"response": {"event": {"event_id": event_id}}}
+        if endpoint == "oauth_token":
+            body = {"access_token": "bench-token"}
+        data = json.dumps(body).encode()
+        handler.send_response(202 if endpoint == "bots_post" else 200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+class SheetsStub(BaseAdapter):
+    """Requests transport answering Sheets API v4 calls from the fixture workbook, after a set delay.
+
+    Mounted under gspread, it lets the batched read be compared with the
+    per-worksheet one on request count and time without reaching Google."""
+
+    def __init__(self, workbook_path: str, latency: float):
+        super().__init__()
+        with open(workbook_path) as f:
+            self.workbook: Dict[str, List[List[Any]]] = json.load(f)
+        self.latency = latency
+        self.calls: "Counter[str]" = Counter()
+
+    def send(self, request: PreparedRequest, **kwargs: Any) -> Response:  # type: ignore[override]
+        sleep(self.latency)
+        url = urlsplit(request.url or "")
+        path = unquote(url.path).split("/v4/spreadsheets/", 1)[1]
+        if path.endswith("/values:batchGet"):
+            self.calls["batch_get"] += 1
+            ranges = parse_qs(url.query).get("ranges", [])
+            missing = [value_range for value_range in ranges if _tab(value_range) not in self.workbook]
+            if missing:
+                return self._response(400, {"error": {
+                    "code": 400, "message": f"Unable to parse range: {missing[0]}", "status": "INVALID_ARGUMENT"}})
+            return self._response(200, {"valueRanges": [
+                {"range": value_range, "majorDimension": "ROWS", "values": self.workbook[_tab(value_range)]}
+                for value_range in ranges]})
+        if "/values/" in path:
+            self.calls["values_get"] += 1
+            tab = _tab(path.split("/values/", 1)[1])
+            return self._response(200, {"range": tab, "majorDimension": "ROWS", "values": self.workbook.get(tab, [])})
+
+        self.calls["metadata"] += 1
+        sheets = [{"properties": {
+            "title": title, "sheetId": i, "index": i, "sheetType": "GRID",
+            "gridProperties": {"rowCount": len(values), "columnCount": max(map(len, values), default=0)}}}
+            for i, (title, values) in enumerate(self.workbook.items())]
+        return self._response(200, {"spreadsheetId": path, "properties": {"title": "Bench"}, "sheets": sheets})
+
+    def close(self):
+        pass
+
+    def _response(self, status: int, body: Dict[str, Any]) -> Response:
+        resp = Response()
+        resp.status_code = status
+        resp.headers["Content-Type"] = "application/json"
+        resp.encoding = "utf-8"
+        resp._content = json.dumps(body).encode()
+        return resp
+
+
+class SMTPStub:
+    """Local SMTP server that accepts every message without TLS or auth and counts sessions and messages."""
+
+    def __init__(self):
+        self.calls: "Counter[str]" = Counter()
+        stub = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                stub.calls["connections"] += 1
+                self.wfile.write(b"220 bench ESMTP\r\n")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    verb = line.decode(errors="replace").strip().upper()
+                    if verb == "DATA":
+                        self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                        while self.rfile.readline().rstrip(b"\r\n") != b".":
+                            pass
+                        stub.calls["messages"] += 1
+                        self.wfile.write(b"250 OK\r\n")
+                    elif verb == "QUIT":
+                        self.wfile.write(b"221 Bye\r\n")
+                        return
+                    else:
+                        self.wfile.write(b"250 OK\r\n")
+
+        self.server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+def write_workbook(path: str, rows: int, people: int):
+    """A fixture workbook with `rows` weekly meetings centred on today."""
+    names = [f"Person {i}" for i in range(people)]
+    first = date.today() - timedelta(weeks=rows // 2)
+    schedule = [["Date", "Leader", "Location", "Time", "Dessert", "Notes"]]
+    for i in range(rows):
+        day = first + timedelta(weeks=i)
+        schedule.append([
+            f"{day.month}/{day.day}/{day.year}", names[i % people], names[(i * 7) % people],
+            "7:00 PM", names[(i * 3) % people], "Bring a friend" if i % 5 == 0 else ""])
+    workbook = {
+        "Schedule": schedule,
+        "Names + Addresses": [["Names", "Address"]] + [[name, f"{i} Main St"] for i, name in enumerate(names)],
+        "All names": [["Names", "Emails"]] + [[name, f"person{i}@example.com"] for i, name in enumerate(names)],
+    }
+    with open(path, "w") as f:
+        json.dump(workbook, f)
+
+
+def write_secrets(workdir: str, smtp_port: int):
+    """Point the bot at the stand-ins, so a benchmark can never reach a real group or mailbox."""
+    with open(os.path.join(workdir, "bot_secrets.py"), "w") as f:
+        f.write(
+            f'BOT_ID = "bench-bot"\nBOT_NAME = "{BOT_NAME}"\nCLIENT_ID = "bench"\n'
+            'CLIENT_SECRET = "bench"\nREDIRECT_URI = "http://127.0.0.1/oauth/callback"\n'
+            f'SMTP_SERVER = "127.0.0.1"\nSMTP_PORT = {smtp_port}\nSMTP_STARTTLS = False\n'
+            'FROM_ADDRESS = "bench@example.com"\n')
+    sys.path.insert(0, workdir)
+
+
+def setup(workdir: str, args: argparse.Namespace) -> Tuple[GroupMeStub, SMTPStub, Counter]:
+    groupme_stub = GroupMeStub()
+    smtp_stub = SMTPStub()
+    write_secrets(workdir, smtp_stub.port)
+    workbook_path = os.path.join(workdir, "workbook.json")
+    write_workbook(workbook_path, args.sheet_rows, args.people)
+
+    # Imported only now, so they pick up the benchmark's bot_secrets
+    import storage
+    from groupme import GroupMeClient, TokenBucket
+    from models.Sheet import Sheet
+    from models.SheetLoader import FixtureSheetLoader
+
+    storage.DB_PATH = os.path.join(workdir, "messages.db")
+    storage.init_db()
+    for group_id in group_ids(args.groups):
+        storage.save_token("bench-token", group_id)
+        with storage.group_scope(group_id):
+            storage.save_sheet_link(SHEET_URL)
+
+    # Measure the bot, not GroupMe's rate limit
+    bucket = TokenBucket(rate=1e6, capacity=10 ** 6)
+    GroupMeClient._instance = GroupMeClient(
+        api_url=groupme_stub.url, oauth_url=groupme_stub.url, bucket=bucket)
+
+    sheet_loads: "Counter[str]" = Counter()
+
+    class CountingLoader(FixtureSheetLoader):
+        def load(self, sheet_url: str):
+            sheet_loads["loads"] += 1
+            return super().load(sheet_url)
+
+    Sheet._instance = Sheet(loader=CountingLoader(workbook_path))
+    return groupme_stub, smtp_stub, sheet_loads
+
+
+def run_micro(iterations: int) -> Dict[str, float]:
+    """Microseconds per call for the in-process hot paths."""
+    import storage
+
+    results: Dict[str, float] = {}
+    with storage.group_scope(GROUP_ID):
+        _run_micro(iterations, results)
+    # Don't let the mail queued above be counted against the first command
+    wait_for_queues()
+    return results
+
+
+def _run_micro(iterations: int, results: Dict[str, float]):
+    import storage
+    from commands import process_message
+    from models.Sheet import Sheet
+
+    def measure(name: str, func, *args):
+        start = perf_counter()
+        for _ in range(iterations):
+            func(*args)
+        results[name] = round((perf_counter() - start) / iterations * 1e6, 2)
+
+    sheet = Sheet.get_instance()
+    measure("sheet_refresh", sheet.update_from_link)
+    for text in ["/ping", "/help", "/schedule show 5", "/nonexistent"]:
+        measure(f"process_message {text}", process_message, "Someone", text)
+    measure("sheet_upcoming_digest", lambda: sheet.upcoming_digest(5))
+
+    ids = iter(range(10 ** 9))
+    measure("storage_save_message", lambda: storage.save_message(f"m{next(ids)}", 0, GROUP_ID, "s"))
+    storage.flush()
+    measure("storage_get_schedule", storage.get_schedule)
+    measure("storage_record_delivery", lambda: storage.record_delivery(f"d{next(ids)}", 0))
+    storage.clear_messages()
+
+
+def run_sheet_reads(workbook_path: str, latency: float, repeats: int) -> Dict[str, Dict[str, float]]:
+    """Time and Sheets API requests per workbook read: one batched request vs. gspread's per-worksheet reads."""
+    import gspread
+    from models.SheetLoader import GoogleClient, GoogleSheetLoader, _data_from_sheets
+
+    stub = SheetsStub(workbook_path, latency)
+    session = Session()
+    session.mount("https://sheets.googleapis.com/", stub)
+    gc = gspread.Client(None, session=session)  # type: ignore[arg-type]
+
+    class StubGoogleClient(GoogleClient):
+        def client(self) -> gspread.Client:
+            return gc
+
+    strategies = {
+        "batched": lambda: GoogleSheetLoader().load(SHEET_URL),
+        "per_worksheet": lambda: _data_from_sheets(gc.open_by_url(SHEET_URL)),
+    }
+    results: Dict[str, Dict[str, float]] = {}
+    previous = GoogleClient._instance
+    GoogleClient._instance = StubGoogleClient()
+    try:
+        for name, load in strategies.items():
+            stub.calls.clear()
+            start = perf_counter()
+            for _ in range(repeats):
+                load()
+            results[name] = {"ms": _ms((perf_counter() - start) / repeats),
+                             "requests": round(sum(stub.calls.values()) / repeats, 2)}
+    finally:
+        GoogleClient._instance = previous
+    return results
+
+
+def run_sheet_build(workbook_path: str, repeats: int) -> Dict[str, float]:
+    """Milliseconds to turn a loaded workbook into events, and to find the next few.
+
+    Each Event used to rebuild the whole name-to-address index and parse its
+    date again on every comparison; now the index is built once per snapshot
+    and dates are parsed up front."""
+    from datetime import datetime
+
+    from models.Event import DATE_FORMAT, Event, build_address_index
+    from models.SheetLoader import FixtureSheetLoader
+
+    schedule_data, people_data, _ = FixtureSheetLoader(workbook_path).load(SHEET_URL)
+    events = [Event(row, build_address_index(people_data)) for row in schedule_data]
+    now = datetime.now()
+
+    def upcoming_reparsing_dates():
+        upcoming = [e for e in events if datetime.strptime(e.date_str, DATE_FORMAT) >= now]
+        upcoming.sort(key=lambda e: datetime.strptime(e.date_str, DATE_FORMAT))
+        return upcoming[:3]
+
+    def upcoming_parsed_dates():
+        upcoming = [e for e in events if e.day is not None and e.day >= now]
+        upcoming.sort(key=lambda e: e.day)  # type: ignore
+        return upcoming[:3]
+
+    def index_per_snapshot():
+        name_to_address = build_address_index(people_data)
+        return [Event(row, name_to_address) for row in schedule_data]
+
+    strategies = {
+        "index_per_row": lambda: [Event(row, build_address_index(people_data)) for row in schedule_data],
+        "index_per_snapshot": index_per_snapshot,
+        "upcoming_reparsing_dates": upcoming_reparsing_dates,
+        "upcoming_parsed_dates": upcoming_parsed_dates,
+    }
+    results: Dict[str, float] = {}
+    for name, build in strategies.items():
+        timings = []
+        for _ in range(repeats):
+            start = perf_counter()
+            build()
+            timings.append(perf_counter() - start)
+        results[name] = _ms(min(timings))
+    return results
+
+
+def run_storage_writes(rows: int, thread_counts: List[int]) -> Dict[str, float]:
+    """Message-log rows written per second: a connection per write (as storage did before it
+    kept one per thread), the per-thread connection with a commit per row, and the buffered
+    save_message() the webhook uses now."""
+    from sqlite3 import connect
+
+    import storage
+
+    insert = "INSERT OR REPLACE INTO messages (id, created_at, group_id, sender_id) VALUES (?, ?, ?, ?)"
+
+    def connection_per_write(row: Tuple[str, int, str, str]):
+        conn = connect(storage.DB_PATH)
+        with conn:
+            conn.execute(insert, row)
+        conn.close()
+
+    strategies = {
+        "connection_per_write": connection_per_write,
+        "thread_connection": lambda row: storage._write(insert, row),
+        "buffered": lambda row: storage.save_message(*row),
+    }
+    results: Dict[str, float] = {}
+    for name, write in strategies.items():
+        for threads in thread_counts:
+            per_thread = rows // threads
+
+            def work(thread: int):
+                for i in range(per_thread):
+                    # A group of its own, so the rows never show up in a benchmarked command
+                    write((f"w-{name}-{threads}-{thread}-{i}", 0, "bench-writes", "s"))
+
+            start = perf_counter()
+            with ThreadPoolExecutor(threads) as pool:
+                list(pool.map(work, range(threads)))
+            storage.flush()
+            results[f"{name} x{threads}"] = round(per_thread * threads / (perf_counter() - start))
+    return results
+
+
+def wait_for_queues():
+    """Block until queued jobs, bot posts and mail have all been sent."""
+    import emailer
+    import jobs
+    import outbox
+    from storage import count_mail, count_outbox
+
+    jobs._queue.join()
+    deadline = monotonic() + DRAIN_TIMEOUT
+    while (count_outbox() or count_mail()) and monotonic() < deadline:
+        outbox.drain()
+        emailer.drain()
+        sleep(0.01)
+
+
+def run_commands(stubs: Tuple[GroupMeStub, SMTPStub, Counter], repeats: int) -> Dict[str, Dict[str, Any]]:
+    """End-to-end time and outbound calls per command, one command at a time."""
+    from main import create_app
+
+    groupme_stub, smtp_stub, sheet_loads = stubs
+    client = create_app().test_client()
+    results: Dict[str, Dict[str, Any]] = {}
+    for text in COUNTED_COMMANDS:
+        before = _outbound(groupme_stub, smtp_stub, sheet_loads)
+        timings: List[float] = []
+        for _ in range(repeats):
+            start = perf_counter()
+            client.post("/new_event", json=_payload(text, sender="Someone"))
+            wait_for_queues()
+            timings.append(perf_counter() - start)
+
+        after = _outbound(groupme_stub, smtp_stub, sheet_loads)
+        outbound = {key: round((after[key] - before.get(key, 0)) / repeats, 2)
+                    for key in after if after[key] != before.get(key, 0)}
+        results[text] = {"p50_ms": _ms(_percentile(timings, 50)), "outbound": outbound}
+    return results
+
+
+def run_load(payloads: List[Payload], concurrency: int) -> Dict[str, Any]:
+    from main import create_app
+
+    app = create_app()
+    local = threading.local()
+
+    def post(payload: Payload) -> Tuple[float, int]:
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+        start = perf_counter()
+        resp = client.post("/new_event", json=payload)
+        return perf_counter() - start, resp.status_code
+
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(post, payloads))
+    elapsed = perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    return {
+        "requests": len(payloads),
+        "concurrency": concurrency,
+        "throughput_rps": round(len(payloads) / elapsed, 1),
+        "p50_ms": _ms(_percentile(latencies, 50)),
+        "p95_ms": _ms(_percentile(latencies, 95)),
+        "p99_ms": _ms(_percentile(latencies, 99)),
+        "statuses": {str(status): count for status, count in Counter(s for _, s in results).items()},
+    }
+
+
+# Runs in a fresh interpreter. The sender thread is kept from starting: the
+# reply only has to be queued, and nothing here may reach GroupMe.
+STARTUP_SCRIPT = """
+import json, sys
+from time import perf_counter
+
+start = perf_counter()
+import main
+app = main.create_app()
+imported = perf_counter()
+
+import jobs, outbox, storage
+storage.init_db()
+outbox.start_sender = lambda: None
+client = app.test_client()
+assert client.get("/healthcheck").status_code == 200
+healthy = perf_counter()
+client.post("/new_event", json=json.loads(sys.argv[1]))
+jobs._queue.join()
+assert storage.count_outbox() == 1
+queued = perf_counter()
+
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "healthcheck_ms": (healthy - start) * 1000,
+    "ping_ms": (queued - start) * 1000,
+    "loaded": [name for name in json.loads(sys.argv[2]) if name in sys.modules],
+}))
+"""
+
+
+def run_startup(workdir: str, runs: int) -> Dict[str, Any]:
+    """Cold-start time of a new worker, up to answering /healthcheck and /ping."""
+    samples: List[Dict[str, Any]] = []
+    for i in range(runs):
+        # Its own directory, so each run starts from an empty database
+        rundir = os.path.join(workdir, f"startup-{i}")
+        os.mkdir(rundir)
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([workdir, REPO_DIR]))
+        proc = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, json.dumps(_payload("/ping", sender="Someone")),
+             json.dumps(LAZY_MODULES)],
+            cwd=rundir, env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(proc.stdout.splitlines()[-1]))
+
+    result: Dict[str, Any] = {
+        key: round(_percentile([sample[key] for sample in samples], 50), 1)
+        for key in ("import_ms", "healthcheck_ms", "ping_ms")}
+    result["eager_imports"] = sorted({name for sample in samples for name in sample["loaded"]})
+    return result
+
+
+def group_ids(count: int) -> List[str]:
+    return [GROUP_ID] + [f"{GROUP_ID}-{i}" for i in range(1, count)]
+
+
+def synthetic_payloads(count: int, seed: int, groups: int) -> List[Payload]:
+    rng = random.Random(seed)
+    targets = group_ids(groups)
+    payloads: List[Payload] = []
+    for _ in range(count):
+        if payloads and rng.random() < DUPLICATE_SHARE:
+            payloads.append(rng.choice(payloads))
+        elif rng.random() < COMMAND_SHARE:
+            payloads.append(_payload(rng.choice(LOAD_COMMANDS), "Someone", rng.choice(targets)))
+        else:
+            payloads.append(_payload(
+                "see you thursday!", rng.choice(["Alex", "Sam", "Jo"]), rng.choice(targets)))
+    return payloads
+
+
+def recorded_payloads(path: str, count: int | None) -> List[Payload]:
+    """Callbacks from a JSON-lines file, repeated in order to fill `count` if given."""
+    with open(path) as f:
+        payloads = [json.loads(line) for line in f if line.strip()]
+    if not payloads:
+        raise SystemExit(f"No payloads in {path}")
+    if count is None:
+        return payloads
+    return [payloads[i % len(payloads)] for i in range(count)]
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Describe everything that got worse than the baseline by more than `tolerance`."""
+    regressions: List[str] = []
+
+    def slower(name: str, now: float, then: float):
+        if then and now > then * (1 + tolerance):
+            regressions.append(f"{name}: {then} -> {now}")
+
+    for key in ("import_ms", "ping_ms"):
+        if key in result["startup"]:
+            slower(f"startup {key}", result["startup"][key], baseline.get("startup", {}).get(key, 0))
+
+    for name, then in baseline.get("sheet_reads", {}).items():
+        now = result["sheet_reads"].get(name)
+        if now is None:
+            continue
+        slower(f"sheet read {name} ms", now["ms"], then["ms"])
+        if now["requests"] > then["requests"]:
+            regressions.append(f"sheet read {name} requests: {then['requests']} -> {now['requests']}")
+
+    for name, then in baseline.get("sheet_build", {}).items():
+        if name in result["sheet_build"]:
+            slower(f"sheet build {name} ms", result["sheet_build"][name], then)
+
+    for name, then in baseline.get("storage_writes", {}).items():
+        now = result["storage_writes"].get(name)
+        if now is not None and now < then * (1 - tolerance):
+            regressions.append(f"storage writes {name} per s: {then} -> {now}")
+
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        slower(f"webhook {key}", result["webhook"][key], baseline["webhook"].get(key, 0))
+    then_rps = baseline["webhook"].get("throughput_rps", 0)
+    if then_rps and result["webhook"]["throughput_rps"] < then_rps * (1 - tolerance):
+        regressions.append(f"webhook throughput_rps: {then_rps} -> {result['webhook']['throughput_rps']}")
+
+    for name, then in baseline.get("micro_us", {}).items():
+        if name in result["micro_us"]:
+            slower(f"{name} us", result["micro_us"][name], then)
+
+    for text, then in baseline.get("commands", {}).items():
+        now = result["commands"].get(text)
+        if now is None:
+            continue
+        slower(f"{text} p50_ms", now["p50_ms"], then["p50_ms"])
+        # Call counts are deterministic, so any increase counts
+        for key, count in now["outbound"].items():
+            if count > then["outbound"].get(key, 0):
+                regressions.append(f"{text} {key} calls: {then['outbound'].get(key, 0)} -> {count}")
+    return regressions
+
+
+def check_startup(startup: Dict[str, Any], budget_ms: float) -> List[str]:
+    """Ways a cold start broke its budget, whether or not there is a baseline."""
+    problems: List[str] = []
+    if startup["ping_ms"] > budget_ms:
+        problems.append(f"startup to /ping took {startup['ping_ms']} ms, budget {budget_ms} ms")
+    if startup["eager_imports"]:
+        problems.append(f"imported before any command needed them: {', '.join(startup['eager_imports'])}")
+    return problems
+
+
+def print_report(result: Dict[str, Any]):
+    startup = result["startup"]
+    print(f"\nCold start: import {startup['import_ms']} ms, /healthcheck {startup['healthcheck_ms']} ms, "
+          f"/ping queued {startup['ping_ms']} ms")
+    print("\nSheet reads (stubbed Sheets API, per workbook read):")
+    for name, stats in result["sheet_reads"].items():
+        print(f"  {name:<20} {stats['ms']:>9} ms  {stats['requests']} requests")
+    config = result["config"]
+    print(f"\nSheet build ({config['sheet_rows']} schedule rows, {config['people']} people, best of {SHEET_BUILD_REPEATS}):")
+    for name, ms in result["sheet_build"].items():
+        print(f"  {name:<28} {ms:>9} ms")
+    print("\nStorage writes (message-log rows per second):")
+    for name, rate in result["storage_writes"].items():
+        print(f"  {name:<28} {rate:>9}/s")
+    webhook = result["webhook"]
+    print(f"\nWebhook: {webhook['requests']} requests at concurrency {webhook['concurrency']}")
+    print(f"  throughput {webhook['throughput_rps']} req/s, p50 {webhook['p50_ms']} ms, "
+          f"p95 {webhook['p95_ms']} ms, p99 {webhook['p99_ms']} ms, statuses {webhook['statuses']}")
+    print("\nCommands (end to end, outbound calls per command):")
+    for text, stats in result["commands"].items():
+        calls = ", ".join(f"{key}={count}" for key, count in sorted(stats["outbound"].items())) or "none"
+        print(f"  {text:<20} {stats['p50_ms']:>9} ms  {calls}")
+    print("\nMicro benchmarks (us per call):")
+    for name, value in result["micro_us"].items():
+        print(f"  {name:<32} {value:>10}")
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Replay GroupMe callbacks against the app with GroupMe, Sheets and SMTP stood in locally.")
+    parser.add_argument("--requests", type=int, default=None,
+                        help=f"callbacks to send (default {DEFAULT_REQUESTS}, or each recorded payload once)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--payloads", help="JSON-lines file of recorded callbacks to replay instead of synthetic ones")
+    parser.add_argument("--sheet-rows", type=int, default=DEFAULT_SHEET_ROWS)
+    parser.add_argument("--people", type=int, default=DEFAULT_PEOPLE)
+    parser.add_argument("--groups", type=int, default=DEFAULT_GROUPS,
+                        help="spread synthetic callbacks over this many groups, each with its own sheet cache")
+    parser.add_argument("--sheets-latency", type=float, default=DEFAULT_SHEETS_LATENCY,
+                        help="seconds added to each stubbed Sheets API request when comparing read strategies")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", metavar="PATH", help="write the results here as a new baseline")
+    parser.add_argument("--compare", metavar="PATH", help="exit non-zero if results regressed against this baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET_MS,
+                        help="exit non-zero if a cold start takes longer than this many ms to queue the /ping reply")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="groupmebot-bench-") as workdir:
+        stubs = setup(workdir, args)
+        if args.payloads:
+            payloads = recorded_payloads(args.payloads, args.requests)
+        else:
+            payloads = synthetic_payloads(args.requests or DEFAULT_REQUESTS, args.seed, args.groups)
+
+        # Load runs last: the replies it queues are still being sent when it returns
+        result = {
+            "config": {"sheet_rows": args.sheet_rows, "people": args.people, "groups": args.groups,
+                       "payloads": args.payloads or "synthetic", "python": sys.version.split()[0]},
+            "startup": run_startup(workdir, STARTUP_RUNS),
+            "sheet_reads": run_sheet_reads(
+                os.path.join(workdir, "workbook.json"), args.sheets_latency, SHEET_READ_REPEATS),
+            "sheet_build": run_sheet_build(os.path.join(workdir, "workbook.json"), SHEET_BUILD_REPEATS),
+            "storage_writes": run_storage_writes(STORAGE_WRITES, STORAGE_WRITE_THREADS),
+            "micro_us": run_micro(MICRO_ITERATIONS),
+            "commands": run_commands(stubs, COMMAND_REPEATS),
+            "webhook": run_load(payloads, args.concurrency),
+        }
+
+    print_report(result)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved baseline to {args.save}")
+    over_budget = check_startup(result["startup"], args.startup_budget)
+    for line in over_budget:
+        print(f"\nStartup over budget: {line}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.compare} (tolerance {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\nNo regressions against {args.compare}")
+    return 1 if over_budget else 0
+
+
+def _payload(text: str, sender: str, group_id: str = GROUP_ID) -> Payload:
+    return {
+        "id": f"{random.getrandbits(64):x}",
+        "name": sender,
+        "text": text,
+        "created_at": int(monotonic() * 1000),
+        "group_id": group_id,
+        "sender_id": f"user-{sender}",
+        "sender_type": "user",
+    }
+
+
+def _endpoint(path: str) -> str:
+    path = path.split("?")[0].rstrip("/")
+    if path.endswith("/bots/post"):
+        return "bots_post"
+    if "/events/" in path:
+        return f"{path.rsplit('/', 1)[1]}_event"
+    if "/messages/" in path:
+        return "delete_message"
+    if path.endswith("/access_token"):
+        return "oauth_token"
+    return path
+
+
+def _outbound(groupme_stub: GroupMeStub, smtp_stub: SMTPStub, sheet_loads: Counter) -> Dict[str, int]:
+    counts = {f"groupme:{key}": value for key, value in groupme_stub.calls.items()}
+    counts.update({f"smtp:{key}": value for key, value in smtp_stub.calls.items()})
+    counts.update({f"sheets:{key}": value for key, value in sheet_loads.items()})
+    return counts
+
+
+def _tab(value_range: str) -> str:
+    """The tab title in an A1 range like 'Names + Addresses'!A1:B2."""
+    if "!" in value_range:
+        value_range = value_range.rsplit("!", 1)[0]
+    if value_range.startswith("'") and value_range.endswith("'"):
+        value_range = value_range[1:-1].replace("''", "'")
+    return value_range
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Tuple
+
+from jobs import submit
+from leader import SQLiteLease
+from storage import (delete_clear_checkpoint, delete_message, get_all_messages, get_clear_checkpoint,
+                     get_clearing_groups, get_group_id, get_messages_until, get_token, group_scope,
+                     save_clear_checkpoint)
+
+
+# Deletes in flight at once (the GroupMe client's rate limiter still applies)
+CLEAR_CONCURRENCY = 4
+# Only one process works through a /clear at a time
+CLEAR_LEASE_TTL = 120
+RENEW_EVERY = 25
+
+
+def start_clear() -> int:
+    """Checkpoint everything the current group logged so far and delete it on the worker pool.
+
+    Returns how many messages are queued for deletion."""
+    messages = get_all_messages()
+    if not messages:
+        return 0
+    save_clear_checkpoint(max(created_at for _, created_at, _, _ in messages))
+    submit(run_clear, get_group_id())
+    return len(messages)
+
+
+def resume_clear():
+    """Pick up any /clear that was interrupted by a restart."""
+    for group_id in get_clearing_groups():
+        submit(run_clear, group_id)
+
+
+def run_clear(group_id: str):
+    from utils import send_message
+
+    lease = SQLiteLease(f"clear:{group_id}", ttl=CLEAR_LEASE_TTL)
+    if not lease.try_acquire():
+        print(f"[DEBUG] Another worker is already running /clear for {group_id}")
+        return
+    with group_scope(group_id):
+        try:
+            cleared, failed = _delete_checkpointed(lease)
+        finally:
+            lease.release()
+
+        if cleared is None:
+            return
+        message = f"Cleared {cleared} recent bot messages."
+        if failed:
+            message += f" {failed} could not be deleted; run /clear again to retry them."
+        send_message(message)
+
+
+def _delete_checkpointed(lease: SQLiteLease) -> Tuple[int | None, int]:
+    checkpoint = get_clear_checkpoint()
+    if checkpoint is None:
+        return None, 0
+    token = get_token()
+    messages = get_messages_until(checkpoint)
+    from groupme import GroupMeClient
+    client = GroupMeClient.get_instance()
+
+    cleared = failed = 0
+    with ThreadPoolExecutor(max_workers=CLEAR_CONCURRENCY) as pool:
+        futures = {
+            pool.submit(client.delete_message, group_id, msg_id, token): msg_id
+            for msg_id, _, group_id, _ in messages
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            msg_id = futures[future]
+            try:
+                resp = future.result()
+            except Exception as e:
+                print(f"Failed to delete {msg_id}: {e!r}")
+                failed += 1
+                continue
+
+            # 404 means it is already gone, which is what we wanted
+            if resp.ok or resp.status_code == 404:
+                delete_message(msg_id)
+                cleared += 1
+            else:
+                print(f"Failed to delete {msg_id}: {resp.status_code} {resp.text}")
+                failed += 1
+
+            if done % RENEW_EVERY == 0:
+                lease.try_acquire()
+
+    delete_clear_checkpoint()
+    return cleared, failed
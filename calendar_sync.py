@@ -0,0 +1,129 @@
+import hashlib
+import json
+
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from pytz import timezone
+
+from exceptions import GroupMeError
+from groupme import GroupMeClient
+from models.Event import Event
+from models.Sheet import Sheet
+from storage import (delete_calendar_event, get_calendar_events, get_group_id, get_token,
+                     save_calendar_event)
+
+
+CALENDAR_TIMEZONE = "America/New_York"
+EVENT_DURATION = timedelta(hours=2)
+# How many upcoming meetings get a GroupMe calendar event
+CALENDAR_SYNC_COUNT = 4
+
+
+class SyncResult:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.failed = 0
+
+    def __str__(self) -> str:
+        summary = f"Calendar synced: {self.created} created, {self.updated} updated, {self.deleted} deleted."
+        if self.failed:
+            summary += f" {self.failed} failed; see the logs."
+        return summary
+
+
+def event_key(event: Event) -> str:
+    return f"{event.date_str}|{event.leader.strip().lower()}"
+
+
+def build_event_payload(event: Event) -> Dict[str, str | int | bool | Dict[str, str]]:
+    tz = timezone(CALENDAR_TIMEZONE)
+    start_at = event.date()
+    if event.start_time:
+        start_at = start_at.replace(hour=event.start_time.hour, minute=event.start_time.minute)
+    start_at = tz.localize(start_at)
+    end_at = start_at + EVENT_DURATION
+
+    return {
+        "name": f"{event.date_str} – Small Group ft. {event.leader}",
+        "start_at": start_at.isoformat(),
+        "end_at": end_at.isoformat(),
+        "timezone": CALENDAR_TIMEZONE,
+        "description": event.notes,
+        "is_all_day": False,
+        "location": {"name": event.location_display}
+    }
+
+
+def sync_calendar(count: int = CALENDAR_SYNC_COUNT) -> SyncResult:
+    """Make GroupMe's calendar match the next `count` meetings in the sheet.
+
+    Only the differences against what was previously synced are sent: new
+    meetings are created, edited ones updated, and ones that disappeared from
+    the sheet deleted. Running it again with nothing changed makes no calls."""
+    token = get_token()
+    group_id = get_group_id()
+    client = GroupMeClient.get_instance()
+    result = SyncResult()
+
+    snapshot = Sheet.get_instance().snapshot()
+    now = datetime.now()
+    future_keys = {event_key(event) for event in snapshot.upcoming(len(snapshot.dated_events), now)}
+    # (event, payload, fingerprint) by key
+    wanted: Dict[str, Tuple[Event, Dict, str]] = {}
+    for event in snapshot.upcoming(count, now):
+        payload = build_event_payload(event)
+        wanted[event_key(event)] = (event, payload, _fingerprint(payload))
+
+    synced = {key: (event_id, fingerprint, starts_at)
+              for key, event_id, fingerprint, starts_at in get_calendar_events(group_id)}
+
+    for key, (event, payload, fingerprint) in wanted.items():
+        try:
+            if key not in synced:
+                resp = client.create_event(group_id, token, payload)
+                _raise_for_status(resp, f"create '{payload['name']}'")
+                event_id = resp.json()["response"]["event"]["event_id"]
+                result.created += 1
+            elif synced[key][1] != fingerprint:
+                event_id = synced[key][0]
+                resp = client.update_event(group_id, event_id, token, payload)
+                _raise_for_status(resp, f"update '{payload['name']}'")
+                result.updated += 1
+            else:
+                continue
+            save_calendar_event(key, event_id, group_id, fingerprint, event.date().timestamp())
+        except (GroupMeError, KeyError, ValueError) as e:
+            print(f"[ERROR] Calendar sync: {e}")
+            result.failed += 1
+
+    now_ts = now.timestamp()
+    for key, (event_id, _, starts_at) in synced.items():
+        if key in future_keys:
+            continue
+        if starts_at < now_ts:
+            # Already happened; keep the GroupMe event, just stop tracking it
+            delete_calendar_event(key, group_id)
+            continue
+        try:
+            resp = client.delete_event(group_id, event_id, token)
+            if resp.status_code != 404:
+                _raise_for_status(resp, f"delete event {event_id}")
+            delete_calendar_event(key, group_id)
+            result.deleted += 1
+        except GroupMeError as e:
+            print(f"[ERROR] Calendar sync: {e}")
+            result.failed += 1
+
+    return result
+
+
+def _fingerprint(payload: Dict) -> str:
+    return hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def _raise_for_status(resp, action: str):
+    if not resp.ok:
+        raise GroupMeError(f"Failed to {action}: {resp.status_code} {resp.text}")
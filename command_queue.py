@@ -0,0 +1,51 @@
+from time import time
+from typing import Tuple
+
+from exceptions import JobQueueFull
+from jobs import submit
+from storage import claim_commands, complete_command, drop_commands, enqueue_command
+
+
+# A command still unfinished this long after it was claimed is assumed lost with
+# its worker and is run again
+CLAIM_TIMEOUT = 300.0
+# Commands older than this are dropped rather than answered so late
+MAX_AGE = 60 * 60
+BATCH_SIZE = 20
+
+# (command id, group id, sender, text)
+Command = Tuple[int, str, str, str]
+
+
+def accept(group_id: str, sender: str, text: str) -> Command:
+    """Persist a command before the webhook answers, so a worker dying before it runs doesn't lose it."""
+    return enqueue_command(group_id, sender, text, CLAIM_TIMEOUT), group_id, sender, text
+
+
+def run(command_id: int, group_id: str, sender: str, text: str):
+    from utils import respond_to_command
+    try:
+        respond_to_command(group_id, sender, text)
+    finally:
+        # Even a command that raised is done; running it again would only raise again
+        complete_command(command_id)
+
+
+def resume() -> int:
+    """Queue commands left behind by a worker that died. Returns how many were queued."""
+    dropped = drop_commands(time() - MAX_AGE)
+    if dropped:
+        print(f"[ERROR] Dropped {dropped} commands older than {MAX_AGE} seconds")
+
+    queued = 0
+    while True:
+        commands = claim_commands(BATCH_SIZE, CLAIM_TIMEOUT)
+        for command in commands:
+            try:
+                submit(run, *command)
+            except JobQueueFull:
+                # The rest stay claimed and are picked up again once that runs out
+                return queued
+            queued += 1
+        if len(commands) < BATCH_SIZE:
+            return queued
@@ -1,19 +1,12 @@
 from difflib import get_close_matches
+from secrets import token_urlsafe
 from typing import Callable
 
-from requests import delete
-
-try:
-    from bot_secrets import CLIENT_ID, REDIRECT_URI
-except ImportError:
-    print("\n\t[ERROR] Missing 'bot_secrets.py'.\n")
-    import sys
-    sys.exit(1)
-
-from emailer import send_email
-from exceptions import NoSheetLink
+import config
+from exceptions import NoAuthenticationToken, SheetException
+from metrics import COMMAND_ERRORS, COMMAND_SECONDS, track
 from models.Sheet import Sheet
-from storage import get_all_messages, clear_messages, get_token, save_schedule, save_sheet_link
+from storage import get_group_id, get_token, save_oauth_state, save_schedule, save_sheet_link
 
 
 _command_registry: list[Callable[[str, str], str]] = []
@@ -38,7 +31,8 @@ def process_message(sender: str, text: str) -> str | None:
 
     if func:
         try:
-            return func(sender, args)
+            with track(COMMAND_SECONDS, COMMAND_ERRORS, command=command_name):
+                return func(sender, args)
         except Exception as e:
             return repr(e)
 
@@ -52,46 +46,44 @@ def process_message(sender: str, text: str) -> str | None:
 @command
 def authenticate(sender: str, args: str) -> str:
     """Provides an authentication link for the admin to authorize the bot."""
-    auth_url = f"https://oauth.groupme.com/oauth/authorize?client_id={CLIENT_ID}&redirect_uri={REDIRECT_URI}"
+    # state brings the group back to /oauth/callback; it is random and single-use,
+    # so a callback can only save a token for the group whose link was followed
+    state = token_urlsafe(16)
+    save_oauth_state(state, get_group_id())
+    auth_url = (f"https://oauth.groupme.com/oauth/authorize?client_id={config.CLIENT_ID}"
+                f"&redirect_uri={config.REDIRECT_URI}&state={state}")
     return f"Click here to authenticate: {auth_url}"
 
 
 @command
 def clear(sender: str, args: str) -> str:
     """Deletes recent bot messages from the chat. (Requires admin authentication with the /authenticate command)"""
-    messages = get_all_messages()
-    token = get_token()
-    if not token:
+    from bulk_delete import start_clear
+    try:
+        get_token()
+    except NoAuthenticationToken:
         return "No access token found. Please authenticate with /authenticate."
 
-    success_count = 0
-    for msg_id, _, group_id, _ in messages:
-        url = f"https://api.groupme.com/v3/conversations/{group_id}/messages/{msg_id}?token={token}"
-        resp = delete(url)
-        if resp.ok:
-            success_count += 1
-        else:
-            print(f"Failed to delete {msg_id}: {resp.status_code} {resp.text}")
-
-    clear_messages()
-    return f"Cleared {success_count} recent bot messages."
+    queued = start_clear()
+    if not queued:
+        return "No bot messages to clear."
+    return f"Deleting {queued} bot messages in the background. I'll report back when it's done."
 
 
 @command
 def calendar(sender: str, args: str) -> str:
-    """Generate calendar event for next <count> events"""
-    from utils import send_next_calendar_event
+    """Sync GroupMe calendar events with the next <count> events (creates, updates and removes as needed)"""
+    from calendar_sync import CALENDAR_SYNC_COUNT, sync_calendar
     parts = args.strip().split(maxsplit=1)
-    subcommand = parts[0].lower() if parts else "create"
-    count = 1
+    subcommand = parts[0].lower() if parts else "sync"
+    count = CALENDAR_SYNC_COUNT
     if len(parts) > 1 and parts[1].isdigit():
         count = int(parts[1])
 
-    if subcommand == "create":
-        send_next_calendar_event(count)
-        return f"Calendar event created for {count} upcoming event(s)."
+    if subcommand in ("sync", "create"):
+        return str(sync_calendar(count))
 
-    return "Unknown subcommand. Usage:\n\t/calendar create [count]"
+    return "Unknown subcommand. Usage:\n\t/calendar sync [count]"
 
 
 @command
@@ -154,30 +146,34 @@ def schedule_show(count: str) -> str:
             working_count)
         schedule_email(str(working_count))
         return formatted_events
-    except NoSheetLink as e:
+    except SheetException as e:
         return repr(e)
 
 
 def schedule_email(count: str) -> str:
     """Send an email with the next <count> events."""
+    from emailer import queue_email
     working_count = 3
     if count.isdigit():
         working_count = int(count)
     try:
-        formatted_events = Sheet.get_instance().formatted_upcoming_events(
-            working_count)
+        digest = Sheet.get_instance().upcoming_digest(working_count)
         emails = Sheet.get_instance().get_all_emails()
-        html_body = formatted_events.replace("\n", "<br>")
-        send_email(emails, "Upcoming events", html_body)
-        return "Email sent!"
-    except NoSheetLink as e:
+        queue_email(emails, "Upcoming events", digest.html)
+        return "Email queued!"
+    except SheetException as e:
         return repr(e)
 
 def schedule_set(schedule: str) -> str:
+    from croniter import croniter
+    from utils import reload_scheduler
     if not schedule:
         return "Please provide a cron expression (e.g., '* * * * *')."
     stripped_schedule = schedule.strip()
+    if not croniter.is_valid(stripped_schedule):
+        return f"'{stripped_schedule}' is not a valid cron expression."
     save_schedule(stripped_schedule)
+    reload_scheduler()
     return f"Updated posting schedule to: {stripped_schedule}"
 
 
@@ -186,4 +182,5 @@ def schedule_link(link: str) -> str:
         return "Please provide the Google Sheet URL."
     stripped_link = link.strip()
     save_sheet_link(stripped_link)
+    Sheet.get_instance().invalidate(get_group_id())
     return f"Updated sheet link to: {stripped_link}"
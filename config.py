@@ -0,0 +1,42 @@
+from typing import Any
+
+from exceptions import MissingSecrets
+
+
+# May be left out or empty: a local SMTP server needs no login or TLS, and a
+# single-group install has no GROUP_BOTS
+OPTIONAL_SECRETS = {"SMTP_USERNAME", "SMTP_PASSWORD", "SMTP_STARTTLS", "GROUP_BOTS", "BOT_GROUP_ID"}
+
+_secrets = None
+
+
+def _load():
+    global _secrets
+    if _secrets is None:
+        try:
+            import bot_secrets
+        except ImportError as e:
+            raise MissingSecrets("Missing 'bot_secrets.py'; copy example.bot_secrets.py and fill it in.") from e
+        _secrets = bot_secrets
+    return _secrets
+
+
+def get(name: str, default: Any = None) -> Any:
+    """An optional setting from bot_secrets."""
+    return getattr(_load(), name, default)
+
+
+def check():
+    """Ensure all uppercase variables in bot_secrets, other than the optional ones, are non-empty."""
+    secrets = _load()
+    for key in dir(secrets):
+        if key.isupper() and key not in OPTIONAL_SECRETS and not getattr(secrets, key):
+            raise MissingSecrets(f"Missing or empty secret: {key}")
+
+
+def __getattr__(name: str) -> Any:
+    # config.BOT_ID and friends: bot_secrets is only read on first use, so
+    # importing a module that needs a secret doesn't fail or exit by itself
+    if name.isupper() and hasattr(_load(), name):
+        return getattr(_load(), name)
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
@@ -0,0 +1,68 @@
+import threading
+
+from collections import OrderedDict
+from time import time
+
+from metrics import CACHE_REQUESTS
+from storage import forget_delivery, prune_deliveries, record_delivery
+
+
+# Recently seen callback ids kept in memory
+LRU_SIZE = 4096
+# How long a callback id is remembered in SQLite (seconds)
+DELIVERY_TTL = 24 * 60 * 60
+
+
+class DeliveryLog:
+    """Remembers which GroupMe callbacks were already handled, so retries are only acknowledged.
+
+    The in-memory LRU answers repeat deliveries to the same worker without
+    touching SQLite; the table catches retries of commands that land on another
+    worker or arrive after a restart. Other callbacks are only logged, and
+    logging one twice is harmless, so they aren't worth a write."""
+
+    _instance = None
+
+    def __init__(self, max_entries: int = LRU_SIZE):
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "DeliveryLog":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def first_delivery(self, message_id: str | None, persist: bool = True) -> bool:
+        """True the first time a callback id is seen, False for every redelivery.
+
+        With persist=False the id is only remembered in this process."""
+        if not message_id:
+            return True
+
+        with self._lock:
+            if message_id in self._seen:
+                self._seen.move_to_end(message_id)
+                CACHE_REQUESTS.inc(cache="deliveries", result="hit")
+                return False
+
+        CACHE_REQUESTS.inc(cache="deliveries", result="miss")
+        is_new = record_delivery(message_id, time()) if persist else True
+        with self._lock:
+            self._seen[message_id] = None
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        return is_new
+
+    def forget(self, message_id: str | None):
+        """Undo first_delivery() for a callback that was turned away, so GroupMe's retry is handled."""
+        if not message_id:
+            return
+        with self._lock:
+            self._seen.pop(message_id, None)
+        forget_delivery(message_id)
+
+
+def prune_old_deliveries():
+    prune_deliveries(time() - DELIVERY_TTL)
@@ -1,26 +1,162 @@
+import os
+import random
 import smtplib
+import threading
 
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from time import monotonic, time
 from typing import List
 
-from bot_secrets import SMTP_SERVER, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, FROM_ADDRESS
+import config
 from exceptions import MailError
+from metrics import SMTP_ERRORS, SMTP_SECONDS, track
+from storage import claim_mail, complete_mail, enqueue_mail, retry_mail
+
+
+SMTP_TIMEOUT = 30
+# Servers drop idle sessions; reconnect instead of reusing one idle longer than this
+SMTP_IDLE_TIMEOUT = 60.0
+# Recipients per message, to stay under provider limits
+MAIL_BATCH_SIZE = 50
+MAX_ATTEMPTS = 5
+RETRY_BASE = 30.0
+CLAIM_TIMEOUT = 300.0
+# Also look for due retries and mail queued by other workers this often
+POLL_INTERVAL = 30.0
+
+_wakeup = threading.Event()
+_worker_pid: int | None = None
+_worker_lock = threading.Lock()
+
+
+class _SMTPConnection:
+    """One authenticated SMTP session, reused until it goes idle or drops."""
+
+    def __init__(self):
+        self._server: smtplib.SMTP | None = None
+        self._last_used = 0.0
+
+    def send(self, address_list: List[str], message: str):
+        if self._server is not None and monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+        try:
+            self._connected().sendmail(config.FROM_ADDRESS, address_list, message)
+        except smtplib.SMTPServerDisconnected:
+            # The server hung up between sends; one fresh connection is worth a try
+            self.close()
+            self._connected().sendmail(config.FROM_ADDRESS, address_list, message)
+        self._last_used = monotonic()
+
+    def close(self):
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._server = None
+
+    def _connected(self) -> smtplib.SMTP:
+        if self._server is None:
+            server = smtplib.SMTP(config.SMTP_SERVER, config.SMTP_PORT, timeout=SMTP_TIMEOUT)
+            if config.get("SMTP_STARTTLS", True):
+                server.starttls()
+            if config.get("SMTP_USERNAME"):
+                server.login(config.SMTP_USERNAME, config.get("SMTP_PASSWORD", ""))
+            self._server = server
+        return self._server
+
+
+_connection = _SMTPConnection()
+_connection_lock = threading.Lock()
+
+
+def use_connection(connection: _SMTPConnection):
+    """Send through connection from now on, e.g. one that does its I/O on an event loop."""
+    global _connection
+    with _connection_lock:
+        _connection.close()
+        _connection = connection
 
 
 def send_email(address_list: List[str], subject: str, body: str):
+    """Send one message right away over the shared SMTP connection."""
+    message = _build_message(address_list, subject, body)
     try:
-        # address_list = ["test1@snowskeleton.net", "test2@snowskeleton.net"]
-        msg = MIMEMultipart()
-        msg["From"] = FROM_ADDRESS
-        msg["To"] = ", ".join(address_list)
-        msg["Subject"] = subject
-
-        msg.attach(MIMEText(body, "html"))
-
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USERNAME, SMTP_PASSWORD)
-            server.sendmail(FROM_ADDRESS, address_list, msg.as_string())
+        with _connection_lock, track(SMTP_SECONDS, SMTP_ERRORS):
+            try:
+                _connection.send(address_list, message)
+            except Exception:
+                # Don't reuse a session left in an unknown state
+                _connection.close()
+                raise
     except Exception as e:
         raise MailError(f"Failed to send email: {e}") from e
+
+
+def queue_email(address_list: List[str], subject: str, body: str):
+    """Persist the mail, split into recipient batches, for the background worker to send."""
+    batches = [address_list[i:i + MAIL_BATCH_SIZE]
+               for i in range(0, len(address_list), MAIL_BATCH_SIZE)]
+    if not batches:
+        return
+    enqueue_mail(batches, subject, body)
+    start_worker()
+    _wakeup.set()
+
+
+def start_worker():
+    global _worker_pid
+    if _worker_pid == os.getpid():
+        return
+    with _worker_lock:
+        if _worker_pid != os.getpid():
+            _worker_pid = os.getpid()
+            threading.Thread(target=_worker_loop, name="mail-worker", daemon=True).start()
+
+
+def _worker_loop():
+    while True:
+        woken = _wakeup.wait(min(POLL_INTERVAL, SMTP_IDLE_TIMEOUT))
+        _wakeup.clear()
+        try:
+            drained = drain()
+        except Exception as e:
+            print(f"[ERROR] Mail queue drain failed: {e!r}")
+            drained = 0
+        if not woken and not drained:
+            # Nothing to do: don't hold a session open for nothing
+            with _connection_lock:
+                _connection.close()
+
+
+def drain() -> int:
+    """Send every due mail batch. Returns how many were attempted."""
+    attempted = 0
+    while True:
+        rows = claim_mail(10, CLAIM_TIMEOUT)
+        if not rows:
+            return attempted
+        for mail_id, recipients, subject, body, attempts in rows:
+            attempted += 1
+            try:
+                send_email(recipients, subject, body)
+            except MailError as e:
+                attempts += 1
+                give_up = attempts >= MAX_ATTEMPTS
+                delay = random.uniform(0.5, 1.0) * RETRY_BASE * 2 ** attempts
+                print(f"[ERROR] {e} ({len(recipients)} recipients, attempt {attempts})")
+                retry_mail(mail_id, attempts, time() + delay, str(e), give_up)
+            else:
+                complete_mail(mail_id)
+
+
+def _build_message(address_list: List[str], subject: str, body: str) -> str:
+    msg = MIMEMultipart()
+    msg["From"] = config.FROM_ADDRESS
+    msg["To"] = ", ".join(address_list)
+    msg["Subject"] = subject
+
+    msg.attach(MIMEText(body, "html"))
+    return msg.as_string()
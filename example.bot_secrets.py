@@ -3,3 +3,18 @@ BOT_NAME = ""
 CLIENT_ID = ""
 CLIENT_SECRET = ""
 REDIRECT_URI = ""
+SMTP_SERVER = ""
+SMTP_PORT = 587
+FROM_ADDRESS = ""
+
+# Optional: leave out for an SMTP server that needs no login, and set
+# SMTP_STARTTLS = False for one without TLS
+# SMTP_USERNAME = ""
+# SMTP_PASSWORD = ""
+# SMTP_STARTTLS = True
+
+# Optional, to serve several groups from one deployment: the bot that posts
+# in each group, by group id. BOT_ID only posts in BOT_GROUP_ID; replies to
+# any other group missing from GROUP_BOTS are dropped.
+# GROUP_BOTS = {"<group id>": "<bot id>"}
+# BOT_GROUP_ID = "<group id of BOT_ID>"
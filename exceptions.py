@@ -1,8 +1,16 @@
 class SheetException(Exception): pass
 class NoSheetLink(SheetException): pass
+class SheetUnavailable(SheetException): pass
+class SheetUnreadable(SheetException): pass
 
 class NoGroupID(Exception): pass
 
 class NoAuthenticationToken(Exception): pass
 
 class MailError(Exception): pass
+
+class JobQueueFull(Exception): pass
+
+class GroupMeError(Exception): pass
+
+class MissingSecrets(Exception): pass
@@ -0,0 +1,166 @@
+import random
+import threading
+
+from time import monotonic, sleep
+from typing import Any, Dict
+
+from requests import Response, Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+from exceptions import GroupMeError
+from metrics import GROUPME_ERRORS, GROUPME_SECONDS, track
+
+
+API_URL = "https://api.groupme.com/v3"
+OAUTH_URL = "https://api.groupme.com/oauth"
+
+# (connect, read) seconds
+TIMEOUT = (3.05, 15)
+POOL_SIZE = 10
+MAX_RETRIES = 3
+# A request that failed after it was sent (a dropped connection, a read timeout,
+# a 5xx) may still have gone through, so only these are retried after one.
+# Anything else, such as a bot post, is only retried if it never went out.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "PUT", "DELETE")
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 8.0
+# GroupMe doesn't publish its limits; this stays comfortably under what bots are allowed
+RATE_LIMIT_PER_SECOND = 5.0
+RATE_LIMIT_BURST = 10
+
+
+class TokenBucket:
+    """Blocks callers so that no more than `rate` requests per second go out on average."""
+
+    def __init__(self, rate: float = RATE_LIMIT_PER_SECOND, capacity: int = RATE_LIMIT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+class GroupMeClient:
+    """Shared, keep-alive HTTP client for every GroupMe API call the bot makes.
+
+    `transport` is anything with requests.Session's request() signature, and the
+    base URLs can point at a local stub server."""
+
+    _instance = None
+
+    def __init__(
+            self,
+            transport: Session | None = None,
+            api_url: str = API_URL,
+            oauth_url: str = OAUTH_URL,
+            bucket: TokenBucket | None = None
+        ):
+        if transport is None:
+            transport = Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            transport.mount("https://", adapter)
+            transport.mount("http://", adapter)
+        self.transport = transport
+        self.api_url = api_url
+        self.oauth_url = oauth_url
+        self.bucket = bucket or TokenBucket()
+
+    @classmethod
+    def get_instance(cls) -> "GroupMeClient":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def request(self, method: str, url: str, endpoint: str = "other", **kwargs: Any) -> Response:
+        """Send a request, retrying with jittered backoff when that is safe (see IDEMPOTENT_METHODS).
+
+        `endpoint` names the call in the metrics, since the URLs embed ids."""
+        with track(GROUPME_SECONDS, GROUPME_ERRORS, endpoint=endpoint):
+            resp = self._send(method, url, **kwargs)
+        if not resp.ok:
+            GROUPME_ERRORS.inc(endpoint=endpoint)
+        return resp
+
+    def _send(self, method: str, url: str, **kwargs: Any) -> Response:
+        kwargs.setdefault("timeout", TIMEOUT)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                resp = self.transport.request(method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                idempotent = method.upper() in IDEMPOTENT_METHODS
+                if not (idempotent or _never_sent(e)) or attempt >= MAX_RETRIES:
+                    raise GroupMeError(f"{method} {url} failed: {e!r}") from e
+                sleep(_backoff(attempt))
+                attempt += 1
+                continue
+
+            if attempt < MAX_RETRIES and (resp.status_code == 429 or resp.status_code >= 500):
+                retry_after = _retry_after(resp)
+                # A 429 with Retry-After was turned away before anything happened
+                if method.upper() in IDEMPOTENT_METHODS or (resp.status_code == 429 and retry_after):
+                    sleep(retry_after or _backoff(attempt))
+                    attempt += 1
+                    continue
+            return resp
+
+    def post_bot_message(self, bot_id: str, text: str) -> Response:
+        return self.request("POST", f"{self.api_url}/bots/post", "bots_post",
+                            json={"bot_id": bot_id, "text": text})
+
+    def delete_message(self, group_id: str, message_id: str, token: str) -> Response:
+        return self.request("DELETE", f"{self.api_url}/conversations/{group_id}/messages/{message_id}",
+                            "delete_message",
+                            headers={"X-Access-Token": token})
+
+    def create_event(self, group_id: str, token: str, payload: Dict[str, Any]) -> Response:
+        return self.request("POST", f"{self.api_url}/conversations/{group_id}/events/create", "create_event",
+                            headers={"X-Access-Token": token}, json=payload)
+
+    def update_event(self, group_id: str, event_id: str, token: str, payload: Dict[str, Any]) -> Response:
+        return self.request("POST", f"{self.api_url}/conversations/{group_id}/events/update", "update_event",
+                            headers={"X-Access-Token": token}, params={"event_id": event_id}, json=payload)
+
+    def delete_event(self, group_id: str, event_id: str, token: str) -> Response:
+        return self.request("DELETE", f"{self.api_url}/conversations/{group_id}/events/delete", "delete_event",
+                            headers={"X-Access-Token": token}, params={"event_id": event_id})
+
+    def exchange_code(self, payload: Dict[str, str]) -> Response:
+        return self.request("POST", f"{self.oauth_url}/access_token", "oauth_token",
+                            data=payload)
+
+
+def _backoff(attempt: int) -> float:
+    # "Full jitter": anywhere between zero and the exponential cap
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def _never_sent(error: Exception) -> bool:
+    """Whether a failed request provably never reached GroupMe: no connection was made."""
+    if isinstance(error, ConnectTimeout):
+        return True
+    cause = error.args[0] if error.args else None
+    # requests wraps urllib3's MaxRetryError, whose reason is the underlying error
+    return isinstance(cause, NewConnectionError) or isinstance(getattr(cause, "reason", None), NewConnectionError)
+
+
+def _retry_after(resp: Response) -> float | None:
+    value = resp.headers.get("Retry-After")
+    if value and value.isdigit():
+        return min(float(value), BACKOFF_MAX)
+    return None
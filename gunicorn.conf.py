@@ -0,0 +1,18 @@
+# gunicorn -c gunicorn.conf.py "main:create_app()"
+bind = "0.0.0.0:5001"
+# Safe to share between workers: building the app opens no connections and starts no threads
+preload_app = True
+
+
+def on_starting(server):
+    from main import prepare
+    from storage import close
+    prepare()
+    # Workers open their own connections; don't leave the migration's open across the fork
+    close()
+
+
+def post_fork(server, worker):
+    # Threads don't survive a fork, so each worker starts its own
+    from main import start_background_work
+    start_background_work()
@@ -0,0 +1,59 @@
+import threading
+
+from queue import Full, Queue
+from typing import Any, Callable, List, Tuple
+
+from exceptions import JobQueueFull
+from metrics import QUEUE_DEPTH
+
+
+WORKER_COUNT = 4
+MAX_QUEUE_DEPTH = 64
+# How long submit() waits for a free slot before giving up
+SUBMIT_TIMEOUT = 0.05
+
+_queue: "Queue[Tuple[Callable[..., Any], Tuple[Any, ...]]]" = Queue(maxsize=MAX_QUEUE_DEPTH)
+_workers: List[threading.Thread] = []
+_workers_lock = threading.Lock()
+
+
+def submit(func: Callable[..., Any], *args: Any):
+    """Queue func(*args) to run on the background worker pool.
+
+    Raises JobQueueFull when the pool is saturated so callers can push back."""
+    _ensure_workers()
+    try:
+        _queue.put((func, args), timeout=SUBMIT_TIMEOUT)
+    except Full as e:
+        raise JobQueueFull(
+            f"Job queue is full ({MAX_QUEUE_DEPTH} pending)") from e
+
+
+def queue_depth() -> int:
+    return _queue.qsize()
+
+
+QUEUE_DEPTH.set_function(queue_depth, queue="jobs")
+
+
+def _ensure_workers():
+    # Started lazily so each gunicorn worker gets its own threads after fork
+    if len(_workers) >= WORKER_COUNT:
+        return
+    with _workers_lock:
+        while len(_workers) < WORKER_COUNT:
+            worker = threading.Thread(
+                target=_worker_loop, name=f"job-worker-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _worker_loop():
+    while True:
+        func, args = _queue.get()
+        try:
+            func(*args)
+        except Exception as e:
+            print(f"[ERROR] Background job {getattr(func, '__name__', func)} failed: {e!r}")
+        finally:
+            _queue.task_done()
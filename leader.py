@@ -0,0 +1,54 @@
+import os
+import socket
+
+from uuid import uuid4
+
+from storage import acquire_lease, release_lease
+
+
+# A leader that stops renewing is replaced after at most this many seconds
+LEASE_TTL = 30
+# Leaders renew (and followers retry) this often
+RENEW_INTERVAL = LEASE_TTL / 3
+
+
+class LeaderLease:
+    """Decides whether this process is the one that should run singleton work."""
+
+    owner: str
+
+    def try_acquire(self) -> bool:
+        """Acquire or renew the lease. Returns True while this process holds it."""
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+
+class LocalLease(LeaderLease):
+    """For a single process: always the leader."""
+
+    def __init__(self):
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def try_acquire(self) -> bool:
+        return True
+
+
+class SQLiteLease(LeaderLease):
+    """A lease row in the bot's SQLite database, shared by every worker on the host."""
+
+    def __init__(self, name: str, ttl: float = LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:8]}"
+
+    def try_acquire(self) -> bool:
+        try:
+            return acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            print(f"[ERROR] Could not renew lease '{self.name}': {e!r}")
+            return False
+
+    def release(self):
+        release_lease(self.name, self.owner)
@@ -1,14 +1,44 @@
-import threading
+from flask import Flask
 
-from storage import init_db
-from routes import app
-from utils import check_secrets, periodic_messages
+import config
+from storage import count_mail, init_db
 
 
-threading.Thread(target=periodic_messages, daemon=True).start()
+def create_app() -> Flask:
+    """Build the Flask app. Importing this module and calling this have no side effects."""
+    from routes import bot
+
+    app = Flask(__name__)
+    app.register_blueprint(bot)
+    return app
+
+
+def prepare():
+    """Once per deployment, before any worker serves: check the secrets and migrate the database."""
+    config.check()
+    init_db()
+
+
+def start_background_work():
+    """Once per worker process (after the fork, under gunicorn): the scheduler and queue workers."""
+    from bulk_delete import resume_clear
+    from command_queue import resume as resume_commands
+    from models.Sheet import Sheet
+    from outbox import start_sender
+    from utils import resync_calendar_on_change, start_scheduler
+
+    Sheet.get_instance().subscribe(resync_calendar_on_change)
+    start_scheduler()
+    resume_clear()
+    resume_commands()
+    start_sender()
+    # The mail stack loads with the first queued email; only start it now for mail left from a previous run
+    if count_mail():
+        from emailer import start_worker as start_mail_worker
+        start_mail_worker()
 
-check_secrets()
-init_db()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5001, debug=True)
+    prepare()
+    start_background_work()
+    create_app().run(host="0.0.0.0", port=5001, debug=True)
@@ -0,0 +1,186 @@
+import threading
+
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+# Seconds; spans a cached lookup up to a slow Sheets or SMTP round trip
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._format_labels(key)} {value}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            help: str,
+            labelnames: Tuple[str, ...] = (),
+            buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+        ):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # per label set: (bucket counts, sum, count)
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        lines: List[str] = []
+        for key, counts, total, count in items:
+            for bound, bucket_count in zip(self.buckets, counts):
+                labels = self._format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+            labels = self._format_labels(key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """A value read at scrape time from callbacks registered by the modules that own it."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, help, labelnames)
+        self._callbacks: Dict[LabelValues, Callable[[], float]] = {}
+
+    def set_function(self, callback: Callable[[], float], **labels: str):
+        with self._lock:
+            self._callbacks[self._key(labels)] = callback
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._callbacks.items())
+        lines: List[str] = []
+        for key, callback in items:
+            try:
+                value = callback()
+            except Exception:
+                # One broken gauge shouldn't take the whole scrape down
+                continue
+            lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+
+@contextmanager
+def track(histogram: Histogram, errors: Counter | None = None, **labels: str) -> Iterator[None]:
+    """Time the block into histogram and count it in errors if it raises."""
+    start = perf_counter()
+    try:
+        yield
+    except Exception:
+        if errors is not None:
+            errors.inc(**labels)
+        raise
+    finally:
+        histogram.observe(perf_counter() - start, **labels)
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+WEBHOOK_SECONDS = Histogram(
+    "groupmebot_webhook_seconds", "Time spent answering GroupMe callbacks.", ("outcome",))
+COMMAND_SECONDS = Histogram(
+    "groupmebot_command_seconds", "Time spent running each chat command.", ("command",))
+COMMAND_ERRORS = Counter(
+    "groupmebot_command_errors_total", "Chat commands that raised.", ("command",))
+SHEET_REFRESH_SECONDS = Histogram(
+    "groupmebot_sheet_refresh_seconds", "Sheet refresh time by stage.", ("stage",))
+SHEET_REFRESH_ERRORS = Counter(
+    "groupmebot_sheet_refresh_errors_total", "Sheet refreshes that failed.")
+STORAGE_SECONDS = Histogram(
+    "groupmebot_storage_seconds", "Time spent in each storage call.", ("op",))
+STORAGE_ERRORS = Counter(
+    "groupmebot_storage_errors_total", "Storage calls that raised.", ("op",))
+SMTP_SECONDS = Histogram(
+    "groupmebot_smtp_send_seconds", "Time spent sending one mail batch over SMTP.")
+SMTP_ERRORS = Counter(
+    "groupmebot_smtp_errors_total", "Mail batches that failed to send.")
+GROUPME_SECONDS = Histogram(
+    "groupmebot_groupme_request_seconds", "Outbound GroupMe API call time, retries included.", ("endpoint",))
+GROUPME_ERRORS = Counter(
+    "groupmebot_groupme_errors_total", "Outbound GroupMe API calls that failed.", ("endpoint",))
+SCHEDULED_JOB_ERRORS = Counter(
+    "groupmebot_scheduled_job_errors_total", "Scheduled job runs that raised.", ("job",))
+CACHE_REQUESTS = Counter(
+    "groupmebot_cache_requests_total", "Cache lookups by cache and result (hit, miss, stale).", ("cache", "result"))
+QUEUE_DEPTH = Gauge(
+    "groupmebot_queue_depth", "Items waiting in each queue.", ("queue",))
@@ -0,0 +1,44 @@
+import threading
+
+from time import monotonic
+
+
+class CircuitBreaker:
+    """Stops calling a failing dependency for a while instead of waiting on it every time.
+
+    After `failure_threshold` consecutive failures the breaker opens and allow()
+    returns False for `reset_timeout` seconds. Then a single trial call is let
+    through: success closes the breaker, failure opens it again."""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = monotonic()
+
+    def is_open(self) -> bool:
+        return self._opened_at is not None
@@ -0,0 +1,71 @@
+import threading
+
+from collections import OrderedDict
+from datetime import date
+from html import escape
+from typing import Callable, List, Tuple
+
+from metrics import CACHE_REQUESTS
+
+from .Event import Event
+
+
+RENDER_CACHE_SIZE = 64
+
+
+class RenderedDigest:
+    __slots__ = ("text", "html")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.html = escape(text).replace("\n", "<br>")
+
+
+class DigestRenderer:
+    """LRU of rendered "Upcoming Events" digests keyed by (snapshot version, count, day).
+
+    Snapshot versions change whenever the schedule does, so stale renders are
+    never hit again and simply age out."""
+
+    _instance = None
+
+    def __init__(self, max_entries: int = RENDER_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[Tuple[int, int, date], RenderedDigest]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls) -> "DigestRenderer":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def render(
+            self,
+            version: int,
+            count: int,
+            day: date,
+            events: Callable[[], List[Event]]
+        ) -> RenderedDigest:
+        key = (version, count, day)
+        with self._lock:
+            rendered = self._cache.get(key)
+            if rendered is not None:
+                self._cache.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="digest", result="hit")
+                return rendered
+        CACHE_REQUESTS.inc(cache="digest", result="miss")
+
+        rendered = RenderedDigest(format_events(events()))
+        with self._lock:
+            self._cache[key] = rendered
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return rendered
+
+
+def format_events(events: List[Event]) -> str:
+    if not events:
+        return "No upcoming events"
+    return "Upcoming Events:\n\n" + "\n\n".join(str(event) for event in events)
@@ -1,12 +1,27 @@
-from datetime import datetime
+from datetime import datetime, time
 from typing import List, Dict
 
 
+DATE_FORMAT = "%m/%d/%Y"
+TIME_FORMAT = "%I:%M %p"
+
+
+def build_address_index(people_data: List[Dict[str, int | float | str]]) -> Dict[str, str]:
+    """Map lower-cased names to addresses, built once per sheet snapshot."""
+    return {str(p.get("Names", "")).strip().lower(): str(p.get("Address", "")).strip()
+            for p in people_data if p.get("Names") and p.get("Address")}
+
+
 class Event:
+    __slots__ = (
+        "date_str", "leader", "location_name", "event_time", "dessert", "notes",
+        "location_display", "day", "start_time",
+    )
+
     def __init__(
             self,
             row: Dict[str, int | float | str],
-            people_data: List[Dict[str, int | float | str]]
+            name_to_address: Dict[str, str]
         ):
         self.date_str = str(row.get("Date", ""))
         self.leader = str(row.get("Leader", ""))
@@ -15,14 +30,18 @@ class Event:
         self.dessert = str(row.get("Dessert", ""))
         self.notes = str(row.get("Notes", ""))
 
-        name_to_address = {str(p.get("Names", "")).strip().lower(): str(p.get("Address", "")).strip()
-                           for p in people_data if p.get("Names") and p.get("Address")}
-
         location_key = str(self.location_name).strip().lower() if self.location_name else ""
         self.location_display = name_to_address.get(location_key, self.location_name)
 
+        # Parsed once here rather than on every comparison; None when the cell is malformed
+        self.day: datetime | None = _parse(self.date_str, DATE_FORMAT)
+        parsed_time = _parse(self.event_time, TIME_FORMAT) if self.event_time else None
+        self.start_time: time | None = parsed_time.time() if parsed_time else None
+
     def date(self) -> datetime:
-        return datetime.strptime(self.date_str, "%m/%d/%Y")
+        if self.day is None:
+            raise ValueError(f"Event date {self.date_str!r} does not match format '{DATE_FORMAT}'")
+        return self.day
 
     def __str__(self) -> str:
         message = f"{self.date().strftime('%a %b %d %Y')}\n"
@@ -34,3 +53,10 @@ class Event:
         if self.notes:
             message += f"\nNotes: {self.notes}"
         return message
+
+
+def _parse(value: str, fmt: str) -> datetime | None:
+    try:
+        return datetime.strptime(value, fmt)
+    except ValueError:
+        return None
@@ -1,23 +1,126 @@
+import hashlib
+import itertools
+import json
+import threading
+
+from bisect import bisect_left
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Dict, Tuple
+from time import time
+from typing import Callable, List, Dict, Tuple
+
+from .CircuitBreaker import CircuitBreaker
+from .DigestRenderer import DigestRenderer, RenderedDigest
+from .Event import Event, build_address_index
+from .SheetLoader import GoogleSheetLoader, SheetLoader, Records, is_outage
+from exceptions import SheetUnavailable, SheetUnreadable
+from metrics import CACHE_REQUESTS, SHEET_REFRESH_ERRORS, SHEET_REFRESH_SECONDS
+from storage import get_group_id, get_sheet_link, load_sheet_snapshot, save_sheet_snapshot
+
+
+# Seconds a fetched snapshot is served before a background refresh is started
+SNAPSHOT_TTL = 300
+# Responses built from a snapshot older than this say so
+STALE_AFTER = 3 * SNAPSHOT_TTL
+# Snapshots kept in memory, one per group; the least recently used group is
+# evicted past either limit. Sizes are each snapshot's JSON length, a lower
+# bound on what the parsed rows take up.
+SHEET_CACHE_MAX_GROUPS = 64
+SHEET_CACHE_MAX_BYTES = 32 * 1024 * 1024
+
+# Snapshot versions are unique across every sheet in the process, so caches keyed
+# on them can't confuse two sheets or a sheet before and after invalidate()
+_versions = itertools.count(1)
+
+
+class ChangeSet:
+    """What changed in the schedule between two snapshots of the same sheet."""
+
+    def __init__(self):
+        self.added: List[Event] = []
+        self.removed: List[Event] = []
+        # (old, new) pairs for rows whose key stayed the same
+        self.modified: List[Tuple[Event, Event]] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.modified)
+
+    def __repr__(self) -> str:
+        return f"ChangeSet(added={len(self.added)}, removed={len(self.removed)}, modified={len(self.modified)})"
+
+
+# (row fingerprint, event) by event key
+KeyedEvents = Dict[str, Tuple[int, Event]]
+
 
-from google.oauth2.service_account import Credentials
-from gspread import Spreadsheet, authorize
+class SheetSnapshot:
+    """Everything read from one Google Sheet at a single point in time."""
 
-from .Event import Event
-from storage import get_sheet_link
+    def __init__(
+            self,
+            sheet_url: str,
+            schedule_data: Records,
+            keyed_events: KeyedEvents,
+            people_data: Records,
+            names_data: Records,
+            version: int,
+            fetched_at: float | None = None
+        ):
+        self.sheet_url = sheet_url
+        self.schedule_data = schedule_data
+        self.keyed_events = keyed_events
+        self.events = [event for _, event in keyed_events.values()]
+        self.people_data = people_data
+        self.names_data = names_data
+        # Only bumped when the schedule itself changes
+        self.version = version
+        self.fetched_at = time() if fetched_at is None else fetched_at
+
+        # Built once per snapshot so lookups are a bisect and a slice
+        self.dated_events = sorted(
+            (event for event in self.events if event.day is not None), key=lambda e: e.day)  # type: ignore
+        self._days = [event.day for event in self.dated_events]
+
+    def age(self) -> float:
+        return time() - self.fetched_at
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "schedule": self.schedule_data,
+            "people": self.people_data,
+            "names": self.names_data,
+        })
+
+    def upcoming(self, count: int, now: datetime) -> List[Event]:
+        start = bisect_left(self._days, now)
+        return self.dated_events[start:start + count]
+
+    def between(self, start: datetime, end: datetime) -> List[Event]:
+        """Events on or after start and before end."""
+        return self.dated_events[bisect_left(self._days, start):bisect_left(self._days, end)]
 
 
-CREDS_PATH = "credentials.json"
-GOOGLE_SHEET_READ_ONLY_SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+class _CacheEntry:
+    def __init__(self, group_id: str, sheet_url: str):
+        self.group_id = group_id
+        self.sheet_url = sheet_url
+        self.snapshot: SheetSnapshot | None = None
+        self.size = 0
+        # Held by whichever thread is fetching, so concurrent refreshes collapse into one
+        self.fetch_lock = threading.Lock()
+        # Per sheet, so one group's failing fetches never lock the others out
+        self.breaker = CircuitBreaker()
+
 
 class Sheet:
     _instance = None
 
-    def __init__(self):
-        self.events: List[Event] = []
-        self.people_data: List[Dict[str, int | float | str]] = []
-        self.names_data: List[Dict[str, int | float | str]] = []
+    def __init__(self, loader: SheetLoader | None = None):
+        self.loader = loader or GoogleSheetLoader()
+        self._subscribers: List[Callable[[str, ChangeSet], None]] = []
+        # By group id, least recently used first
+        self._entries: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._entries_lock = threading.Lock()
 
     @classmethod
     def get_instance(cls) -> "Sheet":
@@ -25,65 +128,241 @@ class Sheet:
             cls._instance = cls()
         return cls._instance
 
+    def snapshot(self) -> SheetSnapshot:
+        """Return the cached snapshot of the current group's sheet.
+
+        A missing snapshot comes from the on-disk mirror if there is one, and is
+        fetched synchronously otherwise. An expired one is still returned,
+        while a single background refresh replaces it."""
+        sheet_url = get_sheet_link()
+        entry = self._entry(get_group_id(), sheet_url)
+
+        snapshot = entry.snapshot
+        if snapshot is None:
+            CACHE_REQUESTS.inc(cache="sheet", result="miss")
+            from_mirror = False
+            with entry.fetch_lock:
+                if entry.snapshot is None:
+                    from_mirror = self._load_mirror(sheet_url, entry)
+                    if not from_mirror:
+                        self._refresh(sheet_url, entry)
+                snapshot = entry.snapshot
+            assert snapshot is not None
+            # The mirror may be days old; don't wait for a second caller to start replacing it
+            if from_mirror and snapshot.age() > SNAPSHOT_TTL:
+                self._refresh_in_background(sheet_url, entry)
+
+        elif snapshot.age() > SNAPSHOT_TTL:
+            CACHE_REQUESTS.inc(cache="sheet", result="stale")
+            self._refresh_in_background(sheet_url, entry)
+        else:
+            CACHE_REQUESTS.inc(cache="sheet", result="hit")
+        return snapshot
+
     def update_from_link(self):
         """Fetch the latest events and people data from the Google Sheet."""
         sheet_url = get_sheet_link()
+        entry = self._entry(get_group_id(), sheet_url)
+        with entry.fetch_lock:
+            self._refresh(sheet_url, entry)
 
-        creds = Credentials.from_service_account_file(  # type: ignore
-            CREDS_PATH, scopes=GOOGLE_SHEET_READ_ONLY_SCOPES)  # type: ignore
-        gc = authorize(creds)
-        all_data = gc.open_by_url(sheet_url)
+    def subscribe(self, callback: Callable[[str, ChangeSet], None]):
+        """Call callback(group_id, changes) whenever a refresh changes a group's schedule.
 
-        schedule_data, people_data, names_data = _data_from_sheets(all_data)
+        The first load of a sheet is not reported, only differences after it.
+        Callbacks run on the refreshing thread, often a background one, so
+        anything slow should be handed to the job queue."""
+        self._subscribers.append(callback)
 
-        self.people_data = people_data
-        self.names_data = names_data
-
-        self.events = []
-        for row in schedule_data:
-            event = Event(row, self.people_data)
-            self.events.append(event)
+    def invalidate(self, group_id: str | None = None):
+        """Drop the cached snapshot for group_id, or every snapshot if not given."""
+        with self._entries_lock:
+            if group_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(group_id, None)
 
     def upcoming_events(self, count: int = 3) -> List[Event]:
         """Return the next 'count' upcoming events."""
-        self.update_from_link()
+        return self.snapshot().upcoming(count, datetime.now())
+
+    def events_between(self, start: datetime, end: datetime) -> List[Event]:
+        """Return events on or after 'start' and before 'end'."""
+        return self.snapshot().between(start, end)
+
+    def events_this_month(self) -> List[Event]:
+        """Return every event in the current calendar month."""
         now = datetime.now()
-        upcoming = [event for event in self.events if event.date() >= now]
-        upcoming.sort(key=lambda e: e.date())
-        return upcoming[:count]
+        month_start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if month_start.month == 12:
+            month_end = month_start.replace(year=month_start.year + 1, month=1)
+        else:
+            month_end = month_start.replace(month=month_start.month + 1)
+        return self.snapshot().between(month_start, month_end)
 
     def formatted_upcoming_events(self, count: int = 3) -> str:
         """Return the next 'count' upcoming events in a pretty printing format"""
-        upcoming_events_strings = [str(event) for event in self.upcoming_events(count)]
-        if not upcoming_events_strings:
-            return "No upcoming events"
+        return self.upcoming_digest(count).text
 
-        message = "Upcoming Events:\n\n" + "\n\n".join(upcoming_events_strings)
-        return message
+    def upcoming_digest(self, count: int = 3) -> RenderedDigest:
+        """Plain-text and HTML renderings of the next 'count' events, shared between callers."""
+        snapshot = self.snapshot()
+        now = datetime.now()
+        digest = DigestRenderer.get_instance().render(
+            snapshot.version, count, now.date(), lambda: snapshot.upcoming(count, now))
+        if snapshot.age() > STALE_AFTER:
+            fetched = datetime.fromtimestamp(snapshot.fetched_at).strftime("%a %b %d %I:%M %p")
+            return RenderedDigest(
+                f"(Schedule as of {fetched}; it may be out of date)\n\n{digest.text}")
+        return digest
 
     def get_all_emails(self) -> List[str]:
-        self.update_from_link()
-        return [row["Emails"] for row in self.names_data if row.get("Emails")]
-
-    
-def _data_from_sheets(data: Spreadsheet) -> Tuple[
-    List[Dict[str, int | float | str]],
-    List[Dict[str, int | float | str]],
-    List[Dict[str, int | float | str]]
-]:
-    schedule_data = []
-    people_data = []
-    names_data = []
-
-    for worksheet in data.worksheets():
-        sheet_name = worksheet.title
-        sheet_rows = worksheet.get_all_records()
-
-        if sheet_name == "Schedule":
-            schedule_data = sheet_rows
-        elif sheet_name == "Names + Addresses":
-            people_data = sheet_rows
-        elif sheet_name == "All names":
-            names_data = sheet_rows
-
-    return schedule_data, people_data, names_data
+        return [row["Emails"] for row in self.snapshot().names_data if row.get("Emails")]
+
+    def _entry(self, group_id: str, sheet_url: str) -> _CacheEntry:
+        with self._entries_lock:
+            entry = self._entries.get(group_id)
+            if entry is None or entry.sheet_url != sheet_url:
+                # New group, or its link changed: start over
+                entry = self._entries[group_id] = _CacheEntry(group_id, sheet_url)
+            self._entries.move_to_end(group_id)
+            return entry
+
+    def _store(self, entry: _CacheEntry, snapshot: SheetSnapshot, payload: str):
+        """Put a new snapshot in entry, then evict least recently used groups past the limits."""
+        with self._entries_lock:
+            entry.snapshot = snapshot
+            entry.size = len(payload)
+            total = sum(cached.size for cached in self._entries.values())
+            while len(self._entries) > 1 and (
+                    len(self._entries) > SHEET_CACHE_MAX_GROUPS or total > SHEET_CACHE_MAX_BYTES):
+                group_id, evicted = next(iter(self._entries.items()))
+                if evicted is entry:
+                    break
+                del self._entries[group_id]
+                total -= evicted.size
+                CACHE_REQUESTS.inc(cache="sheet", result="evicted")
+
+    def _load_mirror(self, sheet_url: str, entry: _CacheEntry) -> bool:
+        """Seed entry from the last good snapshot saved on disk. Caller holds fetch_lock."""
+        try:
+            row = load_sheet_snapshot(sheet_url)
+            if row is None:
+                return False
+            fetched_at, payload, version = row
+            if version is not None and version != _payload_version(payload):
+                raise ValueError(f"payload does not match its version {version}")
+            data = json.loads(payload)
+        except Exception as e:
+            print(f"[ERROR] Could not read the saved snapshot of {sheet_url}: {e!r}")
+            return False
+
+        keyed_events, _ = _diff_events(data["schedule"], build_address_index(data["people"]), None)
+        self._store(entry, SheetSnapshot(
+            sheet_url, data["schedule"], keyed_events, data["people"], data["names"],
+            next(_versions), fetched_at), payload)
+        return True
+
+    def _refresh(self, sheet_url: str, entry: _CacheEntry):
+        """Fetch the sheet into entry and tell subscribers what changed. Caller holds fetch_lock."""
+        if not entry.breaker.allow():
+            SHEET_REFRESH_ERRORS.inc()
+            raise SheetUnavailable("Google Sheets is unreachable right now; try again in a minute")
+        try:
+            schedule_data, people_data, names_data = self.loader.load(sheet_url)
+        except Exception as e:
+            SHEET_REFRESH_ERRORS.inc()
+            if is_outage(e):
+                entry.breaker.record_failure()
+                raise SheetUnavailable(f"Could not fetch the schedule from Google Sheets: {e!r}") from e
+            # Sheets answered: the link is bad or the sheet isn't shared with the bot
+            entry.breaker.record_success()
+            raise SheetUnreadable(f"Could not read the schedule sheet: {e!r}") from e
+        entry.breaker.record_success()
+
+        previous = entry.snapshot
+        with SHEET_REFRESH_SECONDS.time(stage="build"):
+            keyed_events, changes = _diff_events(
+                schedule_data, build_address_index(people_data), previous)
+
+            if previous is not None and not changes:
+                version = previous.version
+            else:
+                version = next(_versions)
+            snapshot = SheetSnapshot(
+                sheet_url, schedule_data, keyed_events, people_data, names_data, version)
+
+        payload = snapshot.to_json()
+        self._store(entry, snapshot, payload)
+        try:
+            save_sheet_snapshot(sheet_url, snapshot.fetched_at, payload, _payload_version(payload))
+        except Exception as e:
+            print(f"[ERROR] Could not save a snapshot of {sheet_url}: {e!r}")
+
+        if previous is not None and changes:
+            for callback in self._subscribers:
+                try:
+                    callback(entry.group_id, changes)
+                except Exception as e:
+                    print(f"[ERROR] Sheet change subscriber {callback!r} failed: {e!r}")
+
+    def _refresh_in_background(self, sheet_url: str, entry: _CacheEntry):
+        if not entry.fetch_lock.acquire(blocking=False):
+            # Someone is already fetching this sheet
+            return
+
+        def refresh():
+            try:
+                self._refresh(sheet_url, entry)
+            except Exception as e:
+                print(f"[ERROR] Background refresh of {sheet_url} failed: {e!r}")
+            finally:
+                entry.fetch_lock.release()
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+def _payload_version(payload: str) -> str:
+    """Content version of a saved snapshot; the same data always gets the same version."""
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def _diff_events(
+        schedule_data: Records,
+        name_to_address: Dict[str, str],
+        previous: SheetSnapshot | None
+    ) -> Tuple[KeyedEvents, ChangeSet]:
+    """Build events for a new snapshot, reusing the previous snapshot's Event for unchanged rows.
+
+    Rows are keyed by date (plus a counter when a date repeats), so editing the
+    leader or location of a meeting shows up as a modification."""
+    old = previous.keyed_events if previous is not None else {}
+    keyed: KeyedEvents = {}
+    changes = ChangeSet()
+    seen_dates: Dict[str, int] = {}
+
+    for row in schedule_data:
+        date_str = str(row.get("Date", ""))
+        occurrence = seen_dates.get(date_str, 0)
+        seen_dates[date_str] = occurrence + 1
+        key = f"{date_str}#{occurrence}"
+
+        location_key = str(row.get("Location", "")).strip().lower()
+        fingerprint = hash((tuple(row.items()), name_to_address.get(location_key)))
+
+        existing = old.get(key)
+        if existing is not None and existing[0] == fingerprint:
+            keyed[key] = existing
+            continue
+
+        event = Event(row, name_to_address)
+        if event.day is None:
+            print(f"[ERROR] Ignoring schedule row with unreadable date {event.date_str!r}")
+        keyed[key] = (fingerprint, event)
+        if existing is None:
+            changes.added.append(event)
+        else:
+            changes.modified.append((existing[1], event))
+
+    changes.removed = [event for key, (_, event) in old.items() if key not in keyed]
+    return keyed, changes
@@ -0,0 +1,205 @@
+import json
+import threading
+
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
+
+from exceptions import SheetUnavailable
+from metrics import SHEET_REFRESH_SECONDS
+
+# gspread and google-auth are the slowest imports in the bot, so they
+# are loaded by the first refresh instead of slowing every process start
+if TYPE_CHECKING:
+    from google.auth.transport.requests import Request
+    from google.oauth2.service_account import Credentials
+    from gspread import Client, Spreadsheet
+
+
+CREDS_PATH = "credentials.json"
+GOOGLE_SHEET_READ_ONLY_SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+# Mint a new access token once the current one is this close to expiring
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+# (connect, read) seconds, so a slow Sheets API fails instead of hanging a command
+SHEETS_TIMEOUT = (5, 20)
+# What Sheets says (with a 400) when a batch names a tab the spreadsheet doesn't have
+MISSING_RANGE_ERROR = "Unable to parse range"
+
+SCHEDULE_TAB = "Schedule"
+PEOPLE_TAB = "Names + Addresses"
+NAMES_TAB = "All names"
+TABS = [SCHEDULE_TAB, PEOPLE_TAB, NAMES_TAB]
+
+Records = List[Dict[str, int | float | str]]
+SheetData = Tuple[Records, Records, Records]
+
+
+class SheetLoader:
+    """Reads the schedule, people and names tabs of a spreadsheet."""
+
+    def load(self, sheet_url: str) -> SheetData:
+        raise NotImplementedError
+
+
+class GoogleClient:
+    """Process-wide holder for one authorized gspread client.
+
+    The credentials file is read once, the client's HTTP session is kept alive
+    across refreshes, and the access token is only re-minted near expiry."""
+
+    _instance = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._creds: "Credentials | None" = None
+        self._client: "Client | None" = None
+        self._token_request: "Request | None" = None
+
+    @classmethod
+    def get_instance(cls) -> "GoogleClient":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def client(self) -> "Client":
+        with self._lock:
+            if self._client is None:
+                from google.auth.transport.requests import Request
+                from google.oauth2.service_account import Credentials
+                from gspread import authorize
+
+                self._creds = Credentials.from_service_account_file(  # type: ignore
+                    CREDS_PATH, scopes=GOOGLE_SHEET_READ_ONLY_SCOPES)  # type: ignore
+                self._client = authorize(self._creds)
+                self._client.set_timeout(SHEETS_TIMEOUT)
+                self._token_request = Request()
+
+            if self._token_expiring():
+                self._creds.refresh(self._token_request)  # type: ignore
+            return self._client
+
+    def access_token(self) -> str:
+        """A current bearer token, for callers making their own Sheets API requests."""
+        self.client()
+        return self._creds.token  # type: ignore
+
+    def _token_expiring(self) -> bool:
+        creds = self._creds
+        if creds is None or not creds.token or creds.expiry is None:
+            return True
+        # google-auth keeps expiry as a naive UTC datetime
+        return creds.expiry - datetime.utcnow() < TOKEN_REFRESH_MARGIN
+
+
+class GoogleSheetLoader(SheetLoader):
+    """Fetches all three tabs from Google Sheets in one batched values request."""
+
+    def load(self, sheet_url: str) -> SheetData:
+        from gspread.utils import extract_id_from_url
+
+        with SHEET_REFRESH_SECONDS.time(stage="auth"):
+            gc = GoogleClient.get_instance().client()
+
+        ranges = [_quote_tab(tab) for tab in TABS]
+        with SHEET_REFRESH_SECONDS.time(stage="fetch"):
+            response = self._batch_get(gc, extract_id_from_url(sheet_url), ranges)
+            if response is None:
+                # A missing tab fails the whole batch; fall back to reading whatever tabs exist
+                return _data_from_sheets(gc.open_by_url(sheet_url))
+
+        value_ranges = response.get("valueRanges", [])
+        with SHEET_REFRESH_SECONDS.time(stage="parse"):
+            schedule_data, people_data, names_data = (
+                _records(value_range.get("values", [])) for value_range in value_ranges)
+        return schedule_data, people_data, names_data
+
+    def _batch_get(self, gc: "Client", spreadsheet_id: str, ranges: List[str]) -> Dict[str, Any] | None:
+        """The values:batchGet response, or None if one of the tabs doesn't exist."""
+        from gspread.exceptions import APIError
+
+        try:
+            return gc.http_client.values_batch_get(spreadsheet_id, ranges)
+        except APIError as e:
+            # Quota, permission and server errors would fail the per-tab reads too, only slower
+            if missing_tab(e.code, e.error.get("message", "")):
+                return None
+            raise
+
+
+class FixtureSheetLoader(SheetLoader):
+    """Reads a local JSON workbook shaped like {"<tab title>": [[header...], [row...], ...]}."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self, sheet_url: str) -> SheetData:
+        with open(self.path) as f:
+            workbook: Dict[str, List[List[Any]]] = json.load(f)
+        schedule_data, people_data, names_data = (
+            _records(workbook.get(tab, [])) for tab in TABS)
+        return schedule_data, people_data, names_data
+
+
+def missing_tab(status: int, message: str) -> bool:
+    """Whether a failed values request failed only because a tab is missing."""
+    return status == 400 and MISSING_RANGE_ERROR in message
+
+
+def outage_status(status: int) -> bool:
+    """Whether an HTTP status means Sheets is down or throttling, rather than refusing this sheet."""
+    return status == 429 or status >= 500
+
+
+def is_outage(error: Exception) -> bool:
+    """Whether a failed load says Google Sheets is unreachable for everyone.
+
+    A bad link, a sheet that isn't shared with the bot or a missing spreadsheet
+    is a problem with one group's sheet, not an outage."""
+    from google.auth.exceptions import TransportError
+    from gspread.exceptions import APIError
+    from requests import ConnectionError, Timeout
+
+    if isinstance(error, (SheetUnavailable, ConnectionError, Timeout, TransportError)):
+        return True
+    if isinstance(error, APIError):
+        return outage_status(error.code)
+    return False
+
+
+def _quote_tab(title: str) -> str:
+    return "'" + title.replace("'", "''") + "'"
+
+
+def _records(values: List[List[Any]]) -> Records:
+    """Turn raw sheet values into dicts keyed by the header row, like get_all_records()."""
+    if not values:
+        return []
+    from gspread.utils import numericise_all
+
+    header = [str(key) for key in values[0]]
+    width = len(header)
+    records: Records = []
+    for row in values[1:]:
+        padded = list(row[:width]) + [""] * (width - len(row))
+        records.append(dict(zip(header, numericise_all(padded, default_blank=""))))
+    return records
+
+
+def _data_from_sheets(data: "Spreadsheet") -> SheetData:
+    schedule_data = []
+    people_data = []
+    names_data = []
+
+    for worksheet in data.worksheets():
+        sheet_name = worksheet.title
+        if sheet_name not in TABS:
+            continue
+        sheet_rows = worksheet.get_all_records()
+
+        if sheet_name == SCHEDULE_TAB:
+            schedule_data = sheet_rows
+        elif sheet_name == PEOPLE_TAB:
+            people_data = sheet_rows
+        elif sheet_name == NAMES_TAB:
+            names_data = sheet_rows
+
+    return schedule_data, people_data, names_data
@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+
+from time import sleep, time
+from typing import List, Tuple
+
+from metrics import QUEUE_DEPTH
+from storage import claim_outbox, complete_outbox, count_outbox, enqueue_outbox, retry_outbox
+
+
+# GroupMe rejects bot posts longer than this
+MAX_MESSAGE_LENGTH = 1000
+# Replies queued within this many seconds of each other are sent as one post
+COALESCE_WINDOW = 0.5
+MAX_ATTEMPTS = 6
+RETRY_BASE = 2.0
+RETRY_MAX = 300.0
+# How long a claimed batch is reserved for this worker before others may take it
+CLAIM_TIMEOUT = 60.0
+BATCH_SIZE = 20
+# Also look for due retries and rows left behind by other workers this often
+POLL_INTERVAL = 5.0
+
+_wakeup = threading.Event()
+_sender_pid: int | None = None
+_sender_lock = threading.Lock()
+
+OutboxRow = Tuple[int, str, str, float, int]
+
+QUEUE_DEPTH.set_function(count_outbox, queue="outbox")
+
+
+def send(bot_id: str, text: str):
+    """Durably queue a bot post; the sender thread delivers it."""
+    enqueue_outbox(bot_id, text)
+    start_sender()
+    _wakeup.set()
+
+
+def start_sender():
+    global _sender_pid
+    if _sender_pid == os.getpid():
+        return
+    with _sender_lock:
+        if _sender_pid != os.getpid():
+            _sender_pid = os.getpid()
+            threading.Thread(target=_sender_loop, name="outbox-sender", daemon=True).start()
+
+
+def _sender_loop():
+    while True:
+        if _wakeup.wait(POLL_INTERVAL):
+            # Let quick follow-up replies land so they can be merged
+            sleep(COALESCE_WINDOW)
+        _wakeup.clear()
+        try:
+            drain()
+        except Exception as e:
+            print(f"[ERROR] Outbox drain failed: {e!r}")
+
+
+def drain():
+    """Send every due outbox row, merging and splitting texts as needed."""
+    while True:
+        rows = claim_outbox(BATCH_SIZE, CLAIM_TIMEOUT)
+        if not rows:
+            return
+        for batch in _coalesce(rows):
+            _deliver(batch)
+
+
+def _coalesce(rows: List[OutboxRow]) -> List[List[OutboxRow]]:
+    """Group consecutive rows for the same bot that were queued close together and fit in one post."""
+    batches: List[List[OutboxRow]] = []
+    for row in rows:
+        if batches:
+            last = batches[-1]
+            merged_length = sum(len(r[2]) + 2 for r in last) + len(row[2])
+            if (last[-1][1] == row[1]
+                    and row[3] - last[-1][3] <= COALESCE_WINDOW
+                    and merged_length <= MAX_MESSAGE_LENGTH):
+                last.append(row)
+                continue
+        batches.append([row])
+    return batches
+
+
+def _deliver(batch: List[OutboxRow]):
+    ids = [row[0] for row in batch]
+    bot_id = batch[0][1]
+    attempts = max(row[4] for row in batch)
+    chunks = split_message("\n\n".join(row[2] for row in batch))
+
+    # requests is only loaded once there is something to post
+    from groupme import GroupMeClient
+    client = GroupMeClient.get_instance()
+    for sent, chunk in enumerate(chunks):
+        try:
+            resp = client.post_bot_message(bot_id, chunk)
+            ok = resp.ok
+            error = f"{resp.status_code} {resp.text}"
+        except Exception as e:
+            ok = False
+            error = repr(e)
+        if ok:
+            continue
+
+        attempts += 1
+        if attempts >= MAX_ATTEMPTS:
+            print(f"[ERROR] Giving up on outbox rows {ids} after {attempts} attempts: {error}")
+            complete_outbox(ids)
+            return
+        delay = random.uniform(0.5, 1.0) * min(RETRY_MAX, RETRY_BASE ** attempts)
+        print(f"[ERROR] Failed to post message, retrying in {delay:.0f}s: {error}")
+        # Chunks that already went out are not re-sent
+        retry_outbox(ids, "\n\n".join(chunks[sent:]), attempts, time() + delay)
+        return
+
+    complete_outbox(ids)
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split text into posts no longer than limit, preferring blank-line (event) boundaries."""
+    chunks: List[str] = []
+    current = ""
+    for block in _blocks(text, limit):
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) <= limit:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = block
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _blocks(text: str, limit: int) -> List[str]:
+    blocks: List[str] = []
+    for block in text.split("\n\n"):
+        while len(block) > limit:
+            # A single oversized event: break at the last line that fits, or hard-cut
+            cut = block.rfind("\n", 0, limit)
+            if cut <= 0:
+                cut = limit
+            blocks.append(block[:cut])
+            block = block[cut:].lstrip("\n")
+        blocks.append(block)
+    return blocks
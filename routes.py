@@ -1,26 +1,56 @@
-from flask import Flask, request
-from requests import post
-
-from commands import process_message
-from storage import save_group_id, save_message, save_token
-try:
-    from bot_secrets import *
-except ImportError:
-    print("\n\t[ERROR] Missing 'bot_secrets.py'.\n")
-    import sys
-    sys.exit(1)
-from utils import to_or_from_the_bot, send_message
-
-app = Flask(__name__)
-
-@app.route("/healthcheck", methods=["GET"])
+from time import perf_counter
+
+from flask import Blueprint, request
+
+import config
+from command_queue import Command, accept as accept_command, run as run_command
+from dedupe import DeliveryLog
+from exceptions import JobQueueFull
+from jobs import submit
+from metrics import WEBHOOK_SECONDS, render
+from storage import complete_command, save_message, save_token, take_oauth_state
+from utils import to_or_from_the_bot
+
+# Registered on the app by main.create_app()
+bot = Blueprint("bot", __name__)
+
+@bot.route("/healthcheck", methods=["GET"])
 def healthcheck():
     return "ok", 200
 
 
-@app.route("/new_event", methods=["POST"])
+@bot.route("/metrics", methods=["GET"])
+def metrics():
+    return render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+
+@bot.route("/new_event", methods=["POST"])
 def new_event():
-    data = request.get_json()
+    start = perf_counter()
+    outcome = "error"
+    try:
+        body, status, outcome = _handle_event(request.get_json())
+    finally:
+        WEBHOOK_SECONDS.observe(perf_counter() - start, outcome=outcome)
+    return body, status
+
+
+def _handle_event(data: dict) -> tuple[str, int, str]:
+    """Returns (body, status, outcome), outcome labelling the webhook latency metric."""
+    outcome, command = accept_event(data)
+    # Commands run on the worker pool so GroupMe gets its answer right away.
+    if command:
+        try:
+            submit(run_command, *command)
+        except JobQueueFull as e:
+            print(f"[ERROR] Dropping command from {command[2]}: {e}")
+            release_event(data, command)
+            return "busy", 503, "busy"
+    return "ok", 200, outcome
+
+
+def accept_event(data: dict) -> tuple[str, Command | None]:
+    """Record a callback. Returns its outcome and, for a command, the persisted command to run."""
     # print(data)
     sender = data.get("name")
     text = data.get("text")
@@ -29,55 +59,76 @@ def new_event():
     group_id = data.get("group_id", "")
     sender_id = data.get("sender_id", "")
 
-    save_group_id(group_id)
-    if to_or_from_the_bot(sender, text):
-        save_message(message_id, created_at, group_id, sender_id)
+    # Only process messages from others that are commands.
+    is_command = bool(sender != config.BOT_NAME and data.get("sender_type") != "bot"
+                      and text and text.startswith("/"))
 
-    # Only process messages from others that are commands
-    if sender != BOT_NAME and text:
-        response = process_message(sender, text)
-        if response:
-            send_message(response)
+    # GroupMe retries callbacks; a repeat only needs acknowledging. Only a command
+    # has to be caught on another worker: logging a message again just replaces its row.
+    if not DeliveryLog.get_instance().first_delivery(message_id, persist=is_command):
+        return "duplicate", None
+
+    try:
+        if to_or_from_the_bot(sender, text):
+            save_message(message_id, created_at, group_id, sender_id)
+
+        if is_command:
+            return "command", accept_command(group_id, sender, text)  # type: ignore
+    except Exception:
+        release_event(data)
+        raise
+    return "ok", None
 
-    return "ok", 200
 
+def release_event(data: dict, command: Command | None = None):
+    """Forget a callback accept_event() recorded but that wasn't handled, so GroupMe's retry is."""
+    if command:
+        complete_command(command[0])
+    DeliveryLog.get_instance().forget(data.get("id"))
 
-@app.route("/", methods=["POST", "GET"])
+
+@bot.route("/", methods=["POST", "GET"])
 def callback():
     return "ok", 200
 
 
-@app.route("/oauth/callback", methods=["GET"])
+@bot.route("/oauth/callback", methods=["GET"])
 def oauth_callback():
-    token = request.args.get("access_token")
+    return complete_oauth(
+        request.args.get("state", ""), request.args.get("access_token"), request.args.get("code"))
+
+
+def complete_oauth(state: str, token: str | None, code: str | None) -> tuple[str, int]:
+    # Only a state issued by /authenticate says which group the token is for
+    group_id = take_oauth_state(state) if state else None
+    if group_id is None:
+        return "This authentication link is invalid or expired. Run /authenticate again.", 400
+
     if token:
-        save_token(token)
-        return "Authentication complete. Token saved."
+        save_token(token, group_id)
+        return "Authentication complete. Token saved.", 200
 
     # Fallback: standard code exchange
-    code = request.args.get("code")
     if not code:
         return "Missing code parameter", 400
 
-    token_url = "https://api.groupme.com/oauth/access_token"
-
     payload = {
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
+        "client_id": config.CLIENT_ID,
+        "client_secret": config.CLIENT_SECRET,
         "code": code,
-        "redirect_uri": REDIRECT_URI
+        "redirect_uri": config.REDIRECT_URI
     }
 
-    resp = post(token_url, data=payload)
+    from groupme import GroupMeClient
+
+    resp = GroupMeClient.get_instance().exchange_code(payload)
 
     if resp.ok:
         access_token = resp.json().get("access_token")
         if access_token:
-            save_token(access_token)
-            return "Authentication complete. Token saved."
+            save_token(access_token, group_id)
+            return "Authentication complete. Token saved.", 200
         else:
             return "Failed to retrieve access token.", 500
     else:
         return f"Error during token exchange: {resp.text}", 500
-
-
@@ -0,0 +1,216 @@
+import atexit
+import heapq
+import threading
+
+from datetime import datetime, timedelta
+from time import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from croniter import croniter
+from pytz import timezone
+
+from leader import RENEW_INTERVAL, LeaderLease, LocalLease
+from metrics import SCHEDULED_JOB_ERRORS
+from storage import claim_job_run, get_last_job_run
+
+
+DEFAULT_TIMEZONE = "America/New_York"
+# A fire missed while the bot was down is run once on startup if it is at most
+# this old; anything older is skipped
+MISFIRE_GRACE = timedelta(hours=1)
+# Job definitions are re-read at least this often (seconds), in case a change
+# slips past the settings check the leader makes each time it wakes
+RELOAD_INTERVAL = 300
+
+
+class Job:
+    def __init__(
+            self,
+            name: str,
+            cron: str,
+            func: Callable[[], None],
+            tz: str = DEFAULT_TIMEZONE,
+            misfire_grace: timedelta = MISFIRE_GRACE
+        ):
+        self.name = name
+        self.cron = cron
+        self.func = func
+        self.tz = timezone(tz)
+        self.misfire_grace = misfire_grace
+        # Bumped whenever the job is (re)scheduled so stale heap entries can be skipped
+        self.generation = 0
+
+    def next_fire(self, after: float) -> float:
+        base = datetime.fromtimestamp(after, self.tz)
+        return croniter(self.cron, base).get_next(float)  # type: ignore
+
+    def prev_fire(self, before: float) -> float:
+        base = datetime.fromtimestamp(before, self.tz)
+        return croniter(self.cron, base).get_prev(float)  # type: ignore
+
+    def same_schedule(self, other: "Job") -> bool:
+        return self.cron == other.cron and self.tz.zone == other.tz.zone
+
+
+class Scheduler:
+    """Runs named cron jobs, sleeping until the next one is due.
+
+    Every process keeps its own heap, but only the holder of the lease runs
+    anything, and each fire is claimed in job_runs so it is delivered once."""
+
+    _instance = None
+
+    def __init__(
+            self,
+            job_source: Callable[[], List[Job]],
+            lease: LeaderLease | None = None,
+            settings_source: Callable[[], Any] | None = None
+        ):
+        self.job_source = job_source
+        self.lease = lease or LocalLease()
+        # What job_source depends on; when it changes (say, a /schedule set handled
+        # by another worker) the leader reloads on its next wake-up
+        self.settings_source = settings_source
+        self._settings: Any = None
+        self.is_leader = False
+        self._next_renew = 0.0
+        self._reschedule_all = False
+        self._jobs: Dict[str, Job] = {}
+        # (fire timestamp, generation, job name)
+        self._heap: List[Tuple[float, int, str]] = []
+        self._cond = threading.Condition()
+        self._next_reload = 0.0
+        self._generation = 0
+        self._thread: threading.Thread | None = None
+
+    @classmethod
+    def get_instance(
+            cls,
+            job_source: Callable[[], List[Job]],
+            lease: LeaderLease | None = None,
+            settings_source: Callable[[], Any] | None = None
+        ) -> "Scheduler":
+        if cls._instance is None:
+            cls._instance = cls(job_source, lease, settings_source)
+        return cls._instance
+
+    def start(self):
+        if self._thread is None:
+            # Hand the lease over on a clean shutdown instead of making the next leader wait out the TTL
+            atexit.register(self.lease.release)
+            self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def reload(self, reschedule_all: bool = False):
+        """Re-read job definitions and reschedule only the jobs that changed.
+
+        Missed runs are only caught up with reschedule_all (startup or taking over
+        as leader); a job whose cron just changed starts at its next fire time."""
+        if self.settings_source is not None:
+            self._settings = self.settings_source()
+        jobs = {job.name: job for job in self.job_source()}
+        with self._cond:
+            for name in list(self._jobs):
+                if reschedule_all or name not in jobs:
+                    del self._jobs[name]
+
+            now = time()
+            for name, job in jobs.items():
+                current = self._jobs.get(name)
+                if current is not None and current.same_schedule(job):
+                    current.func = job.func
+                    continue
+                self._generation += 1
+                job.generation = self._generation
+                self._jobs[name] = job
+                fire_at = self._first_fire(job, now) if reschedule_all else job.next_fire(now)
+                heapq.heappush(self._heap, (fire_at, job.generation, name))
+
+            self._next_reload = now + RELOAD_INTERVAL
+            self._cond.notify()
+
+    def _first_fire(self, job: Job, now: float) -> float:
+        """Next fire time for a job scheduled at startup or takeover, applying the misfire policy."""
+        last_run = get_last_job_run(job.name)
+        if last_run is not None:
+            missed = job.prev_fire(now)
+            if missed > last_run and now - missed <= job.misfire_grace.total_seconds():
+                print(f"[DEBUG] Catching up missed '{job.name}' run from {datetime.fromtimestamp(missed, job.tz)}")
+                return missed
+        return job.next_fire(now)
+
+    def _renew_lease(self):
+        was_leader = self.is_leader
+        self.is_leader = self.lease.try_acquire()
+        self._next_renew = time() + RENEW_INTERVAL
+        if self.is_leader and not was_leader:
+            print(f"[DEBUG] {self.lease.owner} is now running scheduled jobs")
+            # Fires this process skipped as a follower may still be in the misfire window
+            self._next_reload = 0.0
+            self._reschedule_all = True
+
+    def _run(self):
+        while True:
+            if time() >= self._next_renew:
+                self._renew_lease()
+
+            if self.is_leader and self._settings_changed():
+                self._next_reload = 0.0
+
+            if time() >= self._next_reload:
+                try:
+                    self.reload(self._reschedule_all)
+                    self._reschedule_all = False
+                except Exception as e:
+                    print(f"[ERROR] Failed to reload scheduled jobs: {e!r}")
+                    self._next_reload = time() + RELOAD_INTERVAL
+
+            for job, fire_at in self._wait_for_due_jobs():
+                self._dispatch(job, fire_at)
+
+    def _settings_changed(self) -> bool:
+        if self.settings_source is None:
+            return False
+        try:
+            return self.settings_source() != self._settings
+        except Exception as e:
+            print(f"[ERROR] Failed to check scheduled job settings: {e!r}")
+            return False
+
+    def _wait_for_due_jobs(self) -> List[Tuple[Job, float]]:
+        """Sleep until the next fire (or reload), then pop every job that is due."""
+        with self._cond:
+            now = time()
+            wake_at = min(self._next_reload, self._next_renew)
+            if self._heap:
+                wake_at = min(wake_at, self._heap[0][0])
+            if wake_at > now:
+                # reload() notifies, so a changed schedule cuts this short
+                self._cond.wait(wake_at - now)
+                now = time()
+
+            due: List[Tuple[Job, float]] = []
+            while self._heap and self._heap[0][0] <= now:
+                fire_at, generation, name = heapq.heappop(self._heap)
+                job = self._jobs.get(name)
+                if job is None or job.generation != generation:
+                    continue
+                heapq.heappush(self._heap, (job.next_fire(max(fire_at, now)), generation, name))
+                due.append((job, fire_at))
+            return due
+
+    def _dispatch(self, job: Job, fire_at: float):
+        if not self.is_leader:
+            return
+        if not claim_job_run(job.name, int(fire_at), self.lease.owner):
+            # Another process already delivered this fire
+            return
+        threading.Thread(target=_run_job, args=(job,), name=f"job-{job.name}", daemon=True).start()
+
+
+def _run_job(job: Job):
+    try:
+        job.func()
+    except Exception as e:
+        SCHEDULED_JOB_ERRORS.inc(job=job.name)
+        print(f"[ERROR] Scheduled job '{job.name}' failed: {e!r}")
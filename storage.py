@@ -1,142 +1,823 @@
-from sqlite3 import connect
+import atexit
+import json
+import os
+import threading
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from sqlite3 import Connection, connect
+from time import sleep, time
+from typing import Any, Callable, Dict, Iterator, Sequence, TypeVar
 
 from exceptions import NoGroupID, NoSheetLink, NoAuthenticationToken
+from metrics import CACHE_REQUESTS, QUEUE_DEPTH, STORAGE_ERRORS, STORAGE_SECONDS, track
 
 
 DB_PATH = "messages.db"
+# How long a writer waits on another process's lock before giving up (ms)
+BUSY_TIMEOUT_MS = 5000
+# Size of each connection's prepared-statement cache
+STATEMENT_CACHE_SIZE = 64
 
-def init_db():
-    conn = connect(DB_PATH)
-    print("[DEBUG] Running init_db()")
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            id TEXT PRIMARY KEY,
-            created_at INTEGER,
+# How long an /authenticate link can be completed (seconds)
+OAUTH_STATE_TTL = 60 * 60
+
+# Buffered bookkeeping writes are flushed this long after the first one arrives,
+# or as soon as this many message rows are waiting
+FLUSH_INTERVAL = 0.05
+FLUSH_MAX_ROWS = 100
+# After a failed flush the rows stay buffered and are retried this much later
+FLUSH_RETRY_DELAY = 1.0
+
+_local = threading.local()
+# The group the current request or job is for; see group_scope()
+_group: ContextVar[str | None] = ContextVar("group_id", default=None)
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+
+def _timed(func: F) -> F:
+    """Record the call's latency and failures under its own name."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with track(STORAGE_SECONDS, STORAGE_ERRORS, op=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper  # type: ignore
+
+
+def _connection() -> Connection:
+    """Return this thread's persistent connection, opening it on first use.
+
+    Connections are per thread and per process, so gunicorn workers forked
+    after an earlier connect never share a handle with their parent."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+
+    conn = connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                   cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL only fsyncs at checkpoints but never corrupts the database
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    _local.conn = conn
+    _local.pid = os.getpid()
+    return conn
+
+
+def close():
+    """Close this thread's connection, e.g. in the gunicorn master before it forks workers."""
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        conn.close()
+    # data_version is only comparable within one connection
+    _local.__dict__.clear()
+
+
+def _write(sql: str, params: Sequence[Any] = ()):
+    conn = _connection()
+    with conn:
+        conn.execute(sql, params)
+
+
+def _fetchone(sql: str, params: Sequence[Any] = ()) -> tuple | None:
+    return _connection().execute(sql, params).fetchone()
+
+
+def _fetchall(sql: str, params: Sequence[Any] = ()) -> list[tuple]:
+    return _connection().execute(sql, params).fetchall()
+
+
+_pending_messages: list[tuple[str, int, str, str]] = []
+_pending_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_has_pending = threading.Event()
+_batch_full = threading.Event()
+_flusher_pid: int | None = None
+
+
+@_timed
+def flush() -> bool:
+    """Write any buffered message rows in a single transaction. False if they stay buffered.
+
+    Only swapping the buffer holds _pending_lock, so save_message() never waits
+    on the commit. _flush_lock makes a caller wait out a flush already under
+    way, so rows buffered before the call are on disk when it returns."""
+    global _pending_messages
+    with _flush_lock:
+        with _pending_lock:
+            messages = _pending_messages
+            _pending_messages = []
+            _has_pending.clear()
+            _batch_full.clear()
+        if not messages:
+            return True
+
+        try:
+            conn = _connection()
+            with conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO messages (id, created_at, group_id, sender_id)
+                    VALUES (?, ?, ?, ?)
+                """, messages)
+            return True
+        except Exception as e:
+            print(f"[ERROR] Failed to flush {len(messages)} buffered messages: {e!r}")
+            with _pending_lock:
+                _pending_messages = messages + _pending_messages
+                _has_pending.set()
+            return False
+
+
+def _buffer_write():
+    global _flusher_pid
+    if _flusher_pid != os.getpid():
+        _flusher_pid = os.getpid()
+        threading.Thread(target=_flush_loop, name="storage-flusher", daemon=True).start()
+    _has_pending.set()
+    if len(_pending_messages) >= FLUSH_MAX_ROWS:
+        _batch_full.set()
+
+
+def _flush_loop():
+    while True:
+        _has_pending.wait()
+        # Give a burst a moment to collect into one transaction
+        _batch_full.wait(FLUSH_INTERVAL)
+        # This thread is the only one that writes buffered rows in the background,
+        # so nothing may end it
+        try:
+            flushed = flush()
+        except Exception as e:
+            print(f"[ERROR] Storage flusher failed: {e!r}")
+            flushed = False
+        if not flushed:
+            sleep(FLUSH_RETRY_DELAY)
+
+
+atexit.register(flush)
+QUEUE_DEPTH.set_function(lambda: len(_pending_messages), queue="storage_buffer")
+
+
+@contextmanager
+def group_scope(group_id: str) -> Iterator[None]:
+    """Run the block on behalf of group_id: every per-group read and write inside it uses that group."""
+    token = _group.set(group_id)
+    try:
+        yield
+    finally:
+        _group.reset(token)
+
+
+class _Settings:
+    """In-memory copy of one group's settings and credentials."""
+
+    def __init__(self):
+        self.schedule: str | None = None
+        self.link: str | None = None
+        self.token: str | None = None
+
+
+# By group id
+_settings: Dict[str, _Settings] = {}
+_settings_lock = threading.Lock()
+# The settings_version row the cache was loaded at; None until the first load
+_settings_version: int | None = None
+
+
+def _current_settings() -> Dict[str, _Settings]:
+    """Return the settings cache, reloading it if another process changed a setting or token.
+
+    PRAGMA data_version, which only changes when a *different* connection
+    commits, saves reading the version row while nothing was written at all.
+    Every other table's commits change it too, so the settings_version row,
+    bumped by each settings write, decides whether to reload."""
+    global _settings, _settings_version
+    data_version = _fetchone("PRAGMA data_version")[0]  # type: ignore
+    if _settings_version is not None and getattr(_local, "data_version", None) == data_version:
+        CACHE_REQUESTS.inc(cache="settings", result="hit")
+        return _settings
+
+    version = _fetchone("SELECT version FROM settings_version")[0]  # type: ignore
+    _local.data_version = data_version
+    if version == _settings_version:
+        CACHE_REQUESTS.inc(cache="settings", result="hit")
+        return _settings
+    CACHE_REQUESTS.inc(cache="settings", result="miss")
+
+    with _settings_lock:
+        conn = _connection()
+        # One read transaction, so the rows match the version
+        with conn:
+            conn.execute("BEGIN")
+            version = conn.execute("SELECT version FROM settings_version").fetchone()[0]
+            settings: Dict[str, _Settings] = {}
+            for group_id, key, value in conn.execute(
+                    "SELECT group_id, key, value FROM settings WHERE key IN ('schedule', 'link')"):
+                setattr(settings.setdefault(group_id, _Settings()), key, value)
+            for group_id, token in conn.execute("SELECT group_id, token FROM credentials"):
+                settings.setdefault(group_id, _Settings()).token = token
+        _settings = settings
+        _settings_version = version
+    return _settings
+
+
+def _group_settings(group_id: str) -> _Settings:
+    return _current_settings().get(group_id) or _Settings()
+
+
+def _write_settings(sql: str, params: Sequence[Any]):
+    """Write a cached setting and bump settings_version in the same transaction.
+
+    Caller holds _settings_lock and updates the cache itself. The cache only
+    takes the new version if nobody else wrote since it was loaded; otherwise
+    the next read reloads it."""
+    global _settings_version
+    conn = _connection()
+    with conn:
+        conn.execute(sql, params)
+        conn.execute("UPDATE settings_version SET version = version + 1")
+        version = conn.execute("SELECT version FROM settings_version").fetchone()[0]
+    if _settings_version is not None and version == _settings_version + 1:
+        _settings_version = version
+
+
+def _save_setting(key: str, value: str):
+    group_id = get_group_id()
+    if getattr(_group_settings(group_id), key) == value:
+        return
+    with _settings_lock:
+        _write_settings("INSERT OR REPLACE INTO settings (group_id, key, value) VALUES (?, ?, ?)",
+                        (group_id, key, value))
+        setattr(_settings.setdefault(group_id, _Settings()), key, value)
+
+
+def _columns(conn: Connection, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _ensure_column(conn: Connection, table: str, column: str, declaration: str):
+    if column not in _columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+def _migrate_to_groups(conn: Connection):
+    """Move a single-group database's settings and token under the group id the bot last saw."""
+    group_id = ""
+    if "key" in _columns(conn, "settings") and "group_id" not in _columns(conn, "settings"):
+        row = conn.execute("SELECT value FROM settings WHERE key = 'group_id'").fetchone()
+        group_id = row[0] if row else ""
+        conn.execute("ALTER TABLE settings RENAME TO settings_single_group")
+        _create_settings(conn)
+        conn.execute("""
+            INSERT INTO settings (group_id, key, value)
+            SELECT ?, key, value FROM settings_single_group WHERE key != 'group_id'
+        """, (group_id,))
+        conn.execute("DROP TABLE settings_single_group")
+    if "id" in _columns(conn, "credentials"):
+        conn.execute("ALTER TABLE credentials RENAME TO credentials_single_group")
+        _create_credentials(conn)
+        conn.execute("""
+            INSERT INTO credentials (group_id, token)
+            SELECT ?, token FROM credentials_single_group WHERE id = 1
+        """, (group_id,))
+        conn.execute("DROP TABLE credentials_single_group")
+
+
+def _create_settings(conn: Connection):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS settings (
             group_id TEXT,
-            sender_id TEXT
+            key TEXT,
+            value TEXT,
+            PRIMARY KEY (group_id, key)
         )
     """)
-    c.execute("""
+    conn.execute("CREATE INDEX IF NOT EXISTS settings_key ON settings (key)")
+
+
+def _create_credentials(conn: Connection):
+    conn.execute("""
         CREATE TABLE IF NOT EXISTS credentials (
-            id INTEGER PRIMARY KEY,
+            group_id TEXT PRIMARY KEY,
             token TEXT
         )
     """)
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    """)
-    conn.commit()
-    conn.close()
 
 
+def init_db():
+    print("[DEBUG] Running init_db()")
+    conn = _connection()
+    with conn:
+        # Workers started side by side would otherwise both see an old schema and migrate it twice
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id TEXT PRIMARY KEY,
+                created_at INTEGER,
+                group_id TEXT,
+                sender_id TEXT
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS messages_group_created ON messages (group_id, created_at)")
+        _create_credentials(conn)
+        _create_settings(conn)
+        _migrate_to_groups(conn)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS settings_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER
+            )
+        """)
+        conn.execute("INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS job_runs (
+                name TEXT,
+                fire_time INTEGER,
+                ran_at INTEGER,
+                owner TEXT,
+                PRIMARY KEY (name, fire_time)
+            )
+        """)
+        _ensure_column(conn, "job_runs", "owner", "TEXT")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                bot_id TEXT,
+                text TEXT,
+                created_at REAL,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL,
+                claimed_until REAL DEFAULT 0
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (next_attempt_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS command_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_id TEXT,
+                sender TEXT,
+                text TEXT,
+                created_at REAL,
+                claimed_until REAL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS command_queue_claimed ON command_queue (claimed_until)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS mail_queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                recipients TEXT,
+                subject TEXT,
+                body TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt_at REAL,
+                claimed_until REAL DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS mail_queue_due ON mail_queue (failed, next_attempt_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sheet_snapshots (
+                url TEXT PRIMARY KEY,
+                fetched_at REAL,
+                payload TEXT,
+                version TEXT
+            )
+        """)
+        _ensure_column(conn, "sheet_snapshots", "version", "TEXT")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS calendar_events (
+                key TEXT,
+                group_id TEXT,
+                event_id TEXT,
+                fingerprint TEXT,
+                starts_at REAL,
+                PRIMARY KEY (group_id, key)
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS webhook_deliveries (
+                id TEXT PRIMARY KEY,
+                received_at REAL
+            )
+        """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS webhook_deliveries_received ON webhook_deliveries (received_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS oauth_states (
+                state TEXT PRIMARY KEY,
+                group_id TEXT,
+                created_at REAL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT,
+                expires_at REAL
+            )
+        """)
+
+
+@_timed
 def save_message(message_id: str, created_at: int, group_id: str, sender_id: str):
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("""
-        INSERT OR REPLACE INTO messages (id, created_at, group_id, sender_id)
-        VALUES (?, ?, ?, ?)
-    """, (message_id, created_at, group_id, sender_id))
-    conn.commit()
-    conn.close()
+    """Buffer a message-log row; it reaches disk on the next flush()."""
+    with _pending_lock:
+        _pending_messages.append((message_id, created_at, group_id, sender_id))
+        _buffer_write()
 
 
+@_timed
 def get_all_messages() -> list[tuple[str, int, str, str]]:
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, created_at, group_id, sender_id FROM messages")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    """The current group's logged messages."""
+    flush()
+    return _fetchall(
+        "SELECT id, created_at, group_id, sender_id FROM messages WHERE group_id = ?", (get_group_id(),))
 
 
+@_timed
 def clear_messages():
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("DELETE FROM messages")
-    conn.commit()
-    conn.close()
+    flush()
+    _write("DELETE FROM messages WHERE group_id = ?", (get_group_id(),))
+
+
+@_timed
+def get_messages_until(created_at: int) -> list[tuple[str, int, str, str]]:
+    flush()
+    return _fetchall("""
+        SELECT id, created_at, group_id, sender_id FROM messages
+        WHERE group_id = ? AND created_at <= ?
+    """, (get_group_id(), created_at))
+
+
+@_timed
+def delete_message(message_id: str):
+    _write("DELETE FROM messages WHERE id = ?", (message_id,))
+
+
+@_timed
+def save_clear_checkpoint(created_at: int):
+    """Remember that every message the group logged up to created_at is being deleted."""
+    _write("INSERT OR REPLACE INTO settings (group_id, key, value) VALUES (?, 'clear_until', ?)",
+           (get_group_id(), str(created_at)))
 
 
-def save_token(token: str):
+@_timed
+def get_clear_checkpoint() -> int | None:
+    row = _fetchone("SELECT value FROM settings WHERE group_id = ? AND key = 'clear_until'",
+                    (get_group_id(),))
+    return int(row[0]) if row else None
+
+
+@_timed
+def delete_clear_checkpoint():
+    _write("DELETE FROM settings WHERE group_id = ? AND key = 'clear_until'", (get_group_id(),))
+
+
+@_timed
+def get_clearing_groups() -> list[str]:
+    """Groups with a /clear checkpoint, i.e. a clear that hasn't finished."""
+    return [row[0] for row in _fetchall("SELECT group_id FROM settings WHERE key = 'clear_until'")]
+
+
+@_timed
+def save_token(token: str, group_id: str):
     print(token)
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO credentials (id, token) VALUES (1, ?)", (token,))
-    conn.commit()
-    conn.close()
+    with _settings_lock:
+        _write_settings("INSERT OR REPLACE INTO credentials (group_id, token) VALUES (?, ?)",
+                        (group_id, token))
+        _settings.setdefault(group_id, _Settings()).token = token
 
 
+@_timed
 def get_token() -> str:
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT token FROM credentials WHERE id = 1")
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    token = _group_settings(get_group_id()).token
+    if not token:
         raise NoAuthenticationToken(
             "Please authenticate with '/authenticate' first")
-    return row[0]
+    return token
+
+
+@_timed
+def save_oauth_state(state: str, group_id: str):
+    """Remember an /authenticate link's state, so its callback can be tied back to group_id."""
+    _write("INSERT INTO oauth_states (state, group_id, created_at) VALUES (?, ?, ?)",
+           (state, group_id, time()))
 
 
+@_timed
+def take_oauth_state(state: str) -> str | None:
+    """The group an unexpired state was issued to, or None. Each state is only good once."""
+    conn = _connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT group_id FROM oauth_states WHERE state = ? AND created_at >= ?",
+            (state, time() - OAUTH_STATE_TTL)).fetchone()
+        conn.execute("DELETE FROM oauth_states WHERE state = ?", (state,))
+    return row[0] if row else None
+
+
+@_timed
+def prune_oauth_states():
+    _write("DELETE FROM oauth_states WHERE created_at < ?", (time() - OAUTH_STATE_TTL,))
+
+
+@_timed
 def save_schedule(schedule: str):
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO settings (key, value) VALUES ('schedule', ?)", (schedule,))
-    conn.commit()
-    conn.close()
+    _save_setting("schedule", schedule)
 
 
+@_timed
 def get_schedule() -> str | None:
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = 'schedule'")
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+    return _group_settings(get_group_id()).schedule
+
 
+@_timed
+def get_schedules() -> list[tuple[str, str]]:
+    """(group id, cron expression) for every group with a posting schedule."""
+    return [(group_id, settings.schedule)
+            for group_id, settings in _current_settings().items() if settings.schedule]
 
+
+@_timed
 def save_sheet_link(link: str):
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO settings (key, value) VALUES ('link', ?)", (link,))
-    conn.commit()
-    conn.close()
+    _save_setting("link", link)
 
 
+@_timed
 def get_sheet_link() -> str:
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = 'link'")
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    link = _group_settings(get_group_id()).link
+    if not link:
         raise NoSheetLink(
             "Please add a sheet link with /schedule link <google sheet link>")
-    return row[0]
+    return link
 
 
-def save_group_id(group_id: str):
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(
-        "INSERT OR REPLACE INTO settings (key, value) VALUES ('group_id', ?)", (group_id,))
-    conn.commit()
-    conn.close()
+@_timed
+def get_linked_groups() -> list[str]:
+    """Every group with a sheet link."""
+    return [group_id for group_id, settings in _current_settings().items() if settings.link]
 
 
 def get_group_id() -> str:
-    conn = connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT value FROM settings WHERE key = 'group_id'")
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    """The group the current request or job is for."""
+    group_id = _group.get()
+    if not group_id:
         raise NoGroupID("I don't know what group I'm in :(")
-    return row[0]
+    return group_id
+
+
+@_timed
+def claim_job_run(name: str, fire_time: int, owner: str) -> bool:
+    """Record that owner is running this fire. Returns False if it was already claimed."""
+    conn = _connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO job_runs (name, fire_time, ran_at, owner) VALUES (?, ?, ?, ?)",
+            (name, fire_time, int(time()), owner))
+    return cur.rowcount == 1
+
+
+@_timed
+def get_last_job_run(name: str) -> int | None:
+    row = _fetchone("SELECT MAX(fire_time) FROM job_runs WHERE name = ?", (name,))
+    return row[0] if row else None
+
+
+@_timed
+def prune_job_runs(older_than: int):
+    """Delete run records older than older_than, keeping each job's latest run."""
+    _write("""
+        DELETE FROM job_runs
+        WHERE fire_time < ?
+          AND fire_time < (SELECT MAX(fire_time) FROM job_runs AS latest WHERE latest.name = job_runs.name)
+    """, (older_than,))
+
+
+@_timed
+def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    """Take or renew the named lease if it is free, expired or already ours."""
+    now = time()
+    conn = _connection()
+    with conn:
+        cur = conn.execute("""
+            UPDATE leases SET owner = ?, expires_at = ?
+            WHERE name = ? AND (owner = ? OR expires_at < ?)
+        """, (owner, now + ttl, name, owner, now))
+        if cur.rowcount == 0:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO leases (name, owner, expires_at) VALUES (?, ?, ?)",
+                (name, owner, now + ttl))
+    return cur.rowcount == 1
+
+
+@_timed
+def release_lease(name: str, owner: str):
+    _write("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+
+
+@_timed
+def enqueue_command(group_id: str, sender: str, text: str, claim_for: float) -> int:
+    """Persist an accepted command, claimed for claim_for seconds by the worker about to run it."""
+    now = time()
+    conn = _connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO command_queue (group_id, sender, text, created_at, claimed_until) VALUES (?, ?, ?, ?, ?)",
+            (group_id, sender, text, now, now + claim_for))
+    return cur.lastrowid  # type: ignore
+
+
+@_timed
+def claim_commands(limit: int, claim_for: float) -> list[tuple[int, str, str, str]]:
+    """Claim commands whose claim ran out, i.e. whose worker died before finishing them."""
+    now = time()
+    conn = _connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT id, group_id, sender, text FROM command_queue
+            WHERE claimed_until <= ? ORDER BY id LIMIT ?
+        """, (now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE command_queue SET claimed_until = ? WHERE id = ?",
+            [(now + claim_for, row[0]) for row in rows])
+    return rows
+
+
+@_timed
+def complete_command(command_id: int):
+    _write("DELETE FROM command_queue WHERE id = ?", (command_id,))
+
+
+@_timed
+def drop_commands(older_than: float) -> int:
+    """Delete commands accepted before older_than. Returns how many there were."""
+    conn = _connection()
+    with conn:
+        cur = conn.execute("DELETE FROM command_queue WHERE created_at < ?", (older_than,))
+    return cur.rowcount
+
+
+@_timed
+def enqueue_outbox(bot_id: str, text: str):
+    now = time()
+    _write(
+        "INSERT INTO outbox (bot_id, text, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+        (bot_id, text, now, now))
+
+
+@_timed
+def claim_outbox(limit: int, claim_for: float) -> list[tuple[int, str, str, float, int]]:
+    """Claim due outbox rows for claim_for seconds so no other worker sends them."""
+    now = time()
+    conn = _connection()
+    with conn:
+        # IMMEDIATE takes the write lock up front, so two workers can't claim the same rows
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT id, bot_id, text, created_at, attempts FROM outbox
+            WHERE next_attempt_at <= ? AND claimed_until <= ?
+            ORDER BY id LIMIT ?
+        """, (now, now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE outbox SET claimed_until = ? WHERE id = ?",
+            [(now + claim_for, row[0]) for row in rows])
+    return rows
+
+
+@_timed
+def complete_outbox(ids: list[int]):
+    conn = _connection()
+    with conn:
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids])
+
+
+@_timed
+def retry_outbox(ids: list[int], text: str, attempts: int, next_attempt_at: float):
+    """Fold the rows into the first one, holding only the text still to be sent."""
+    conn = _connection()
+    with conn:
+        conn.execute("""
+            UPDATE outbox SET text = ?, attempts = ?, next_attempt_at = ?, claimed_until = 0
+            WHERE id = ?
+        """, (text, attempts, next_attempt_at, ids[0]))
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(row_id,) for row_id in ids[1:]])
+
+
+@_timed
+def count_outbox() -> int:
+    return _fetchone("SELECT COUNT(*) FROM outbox")[0]  # type: ignore
+
+
+@_timed
+def enqueue_mail(batches: list[list[str]], subject: str, body: str):
+    now = time()
+    conn = _connection()
+    with conn:
+        conn.executemany(
+            "INSERT INTO mail_queue (recipients, subject, body, next_attempt_at) VALUES (?, ?, ?, ?)",
+            [(json.dumps(batch), subject, body, now) for batch in batches])
+
+
+@_timed
+def claim_mail(limit: int, claim_for: float) -> list[tuple[int, list[str], str, str, int]]:
+    """Claim due mail batches for claim_for seconds so no other worker sends them."""
+    now = time()
+    conn = _connection()
+    with conn:
+        conn.execute("BEGIN IMMEDIATE")
+        rows = conn.execute("""
+            SELECT id, recipients, subject, body, attempts FROM mail_queue
+            WHERE failed = 0 AND next_attempt_at <= ? AND claimed_until <= ?
+            ORDER BY id LIMIT ?
+        """, (now, now, limit)).fetchall()
+        conn.executemany(
+            "UPDATE mail_queue SET claimed_until = ? WHERE id = ?",
+            [(now + claim_for, row[0]) for row in rows])
+    return [(row_id, json.loads(recipients), subject, body, attempts)
+            for row_id, recipients, subject, body, attempts in rows]
+
+
+@_timed
+def complete_mail(mail_id: int):
+    _write("DELETE FROM mail_queue WHERE id = ?", (mail_id,))
+
+
+@_timed
+def retry_mail(mail_id: int, attempts: int, next_attempt_at: float, error: str, give_up: bool):
+    """Record a failed send; rows that give up stay in the table for inspection."""
+    _write("""
+        UPDATE mail_queue SET attempts = ?, next_attempt_at = ?, claimed_until = 0,
+                              failed = ?, last_error = ?
+        WHERE id = ?
+    """, (attempts, next_attempt_at, int(give_up), error, mail_id))
+
+
+@_timed
+def count_mail() -> int:
+    """Mail batches still waiting to be sent; ones that gave up are not counted."""
+    return _fetchone("SELECT COUNT(*) FROM mail_queue WHERE failed = 0")[0]  # type: ignore
+
+
+# Here rather than in emailer, which isn't imported until mail is queued
+QUEUE_DEPTH.set_function(count_mail, queue="mail")
+
+
+@_timed
+def save_sheet_snapshot(url: str, fetched_at: float, payload: str, version: str):
+    _write(
+        "INSERT OR REPLACE INTO sheet_snapshots (url, fetched_at, payload, version) VALUES (?, ?, ?, ?)",
+        (url, fetched_at, payload, version))
+
+
+@_timed
+def load_sheet_snapshot(url: str) -> tuple[float, str, str | None] | None:
+    """(fetched at, payload, version) of the saved snapshot; version is None for rows saved without one."""
+    return _fetchone("SELECT fetched_at, payload, version FROM sheet_snapshots WHERE url = ?", (url,))
+
+
+@_timed
+def get_calendar_events(group_id: str) -> list[tuple[str, str, str, float]]:
+    """(key, event id, fingerprint, start timestamp) for every synced calendar event."""
+    return _fetchall(
+        "SELECT key, event_id, fingerprint, starts_at FROM calendar_events WHERE group_id = ?",
+        (group_id,))
+
+
+@_timed
+def save_calendar_event(key: str, event_id: str, group_id: str, fingerprint: str, starts_at: float):
+    _write("""
+        INSERT OR REPLACE INTO calendar_events (key, group_id, event_id, fingerprint, starts_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, (key, group_id, event_id, fingerprint, starts_at))
+
+
+@_timed
+def delete_calendar_event(key: str, group_id: str):
+    _write("DELETE FROM calendar_events WHERE key = ? AND group_id = ?", (key, group_id))
+
+
+@_timed
+def record_delivery(delivery_id: str, received_at: float) -> bool:
+    """Remember a webhook delivery. Returns False if it was already recorded."""
+    conn = _connection()
+    with conn:
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO webhook_deliveries (id, received_at) VALUES (?, ?)",
+            (delivery_id, received_at))
+    return cur.rowcount == 1
+
+
+@_timed
+def forget_delivery(delivery_id: str):
+    _write("DELETE FROM webhook_deliveries WHERE id = ?", (delivery_id,))
+
+
+@_timed
+def prune_deliveries(older_than: float):
+    _write("DELETE FROM webhook_deliveries WHERE received_at < ?", (older_than,))
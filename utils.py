@@ -1,117 +1,135 @@
-from croniter import croniter
-from datetime import datetime, timedelta
-from pytz import timezone
-from typing import Dict
-
-from requests import post
-from time import sleep
-
-from commands import schedule_show
-try:
-    from bot_secrets import BOT_NAME, BOT_ID
-except ImportError:
-    print("\n\t[ERROR] Missing 'bot_secrets.py'.\n")
-    import sys
-    sys.exit(1)
-from exceptions import NoAuthenticationToken
-from models.Event import Event
-from models.Sheet import Sheet
-from storage import get_schedule, get_token, get_group_id
-
-
-def check_secrets():
-    """Ensure all uppercase variables in bot_secrets are non-empty."""
-    try:
-        import bot_secrets
-    except ImportError:
-        print("\n\t[ERROR] Missing 'bot_secrets.py'.\n")
-        import sys
-        sys.exit(1)
+import zlib
+
+from datetime import datetime
+from functools import partial
+from typing import TYPE_CHECKING, List
+
+from time import time
+
+import config
+from commands import process_message, schedule_show
+from dedupe import prune_old_deliveries
+from exceptions import JobQueueFull, NoAuthenticationToken, NoGroupID, SheetException
+import outbox
+from leader import SQLiteLease
+from storage import (get_group_id, get_linked_groups, get_schedules, group_scope, prune_job_runs,
+                     prune_oauth_states)
 
-    for key in dir(bot_secrets):
-        if key.isupper():
-            value = getattr(bot_secrets, key)
-            if not value:
-                raise ValueError(f"Missing or empty secret: {key}")
+if TYPE_CHECKING:
+    from models.Sheet import ChangeSet
+    from scheduler import Job
+
+
+# Run records older than this are pruned (seconds)
+JOB_RUN_RETENTION = 30 * 24 * 60 * 60
 
 
 def to_or_from_the_bot(sender: str, text: str) -> bool:
     if not text:
         return False
-    if sender == BOT_NAME:
+    if sender == config.BOT_NAME:
         return True
     if text.startswith("/"):
         return True
     return False
 
 
+def respond_to_command(group_id: str, sender: str, text: str):
+    """Run a chat command for group_id and post its response, if any, back to the group."""
+    with group_scope(group_id):
+        response = process_message(sender, text)
+        if response:
+            send_message(response)
+
+
 def send_message(text: str):
-    url = "https://api.groupme.com/v3/bots/post"
-    data = {"bot_id": BOT_ID, "text": text}
-    post(url, json=data)
+    """Queue a post to the current group; see outbox.py for chunking, merging and retries."""
+    group_id = get_group_id()
+    bot_id = bot_for_group(group_id)
+    if bot_id is None:
+        # A bot can only post in its own group; anywhere else the reply would land in the wrong chat
+        print(f"[ERROR] No bot for group {group_id} in GROUP_BOTS; dropping reply")
+        return
+    outbox.send(bot_id, text)
+
+
+def bot_for_group(group_id: str) -> str | None:
+    """The bot that posts in group_id, or None if this deployment has none there."""
+    group_bots = config.get("GROUP_BOTS", {})
+    if group_id in group_bots:
+        return group_bots[group_id]
+    bot_group = config.get("BOT_GROUP_ID", "")
+    # With a single bot and no BOT_GROUP_ID, callbacks can only come from the bot's own group
+    if group_id == bot_group or not (group_bots or bot_group):
+        return config.BOT_ID
+    return None
+
 
+def scheduled_jobs() -> List["Job"]:
+    """Everything the scheduler should run, built from the current settings.
 
-def periodic_messages():
-    while True:
-        send_scheduled_schedule()
-        # this needs logic to only create it a day ahead of time and not create duplicate events
-        # send_next_calendar_event()
-        sleep(60)
+    Every group gets its own digest and calendar jobs, so the scheduler runs
+    each group's on its own thread instead of working through them in turn."""
+    from command_queue import resume as resume_commands
+    from scheduler import Job
+    # Picks up commands whose worker died between accepting and finishing them
+    jobs = [Job("prune", "30 3 * * *", prune_old_records), Job("commands", "*/5 * * * *", resume_commands)]
+    for group_id, cron_schedule in get_schedules():
+        jobs.append(Job(f"digest:{group_id}", cron_schedule, partial(send_scheduled_schedule, group_id)))
+    for group_id in get_linked_groups():
+        # Spread the hourly syncs over the hour rather than hitting Sheets all at once
+        minute = zlib.crc32(group_id.encode()) % 60
+        jobs.append(Job(f"calendar:{group_id}", f"{minute} * * * *", partial(sync_calendar_quietly, group_id)))
+    return jobs
 
 
-def send_scheduled_schedule():
-    local_tz = timezone("America/New_York")
-    cron_schedule = get_schedule()
-    if cron_schedule:
-        now = datetime.now(local_tz)
+def scheduled_job_settings() -> tuple:
+    """The settings scheduled_jobs() is built from. Cheap: it reads the version-checked settings cache."""
+    return tuple(get_schedules()), tuple(get_linked_groups())
 
-        # Truncate seconds for a clean comparison
-        base = now.replace(second=0, microsecond=0)
 
-        if croniter.match(cron_schedule, base):
-            send_message(schedule_show("3"))
+def start_scheduler():
+    # croniter and pytz come in with the scheduler, when it starts rather than at import
+    from scheduler import Scheduler
+    Scheduler.get_instance(scheduled_jobs, SQLiteLease("scheduler"), scheduled_job_settings).start()
 
 
-def send_next_calendar_event(count: int = 1):
-    sheet = Sheet()
-    for event in sheet.upcoming_events(count):
-        create_groupme_event(event)
+def reload_scheduler():
+    """Pick up schedule changes in this worker right away; the leader, if elsewhere, notices within seconds."""
+    from scheduler import Scheduler
+    Scheduler.get_instance(scheduled_jobs).reload()
 
 
-def create_groupme_event(event: Event):
-    token = ""
+def send_scheduled_schedule(group_id: str):
+    with group_scope(group_id):
+        send_message(schedule_show("3"))
+
+
+def sync_calendar_quietly(group_id: str):
+    from calendar_sync import sync_calendar
     try:
-        token = get_token()
-    except NoAuthenticationToken as e:
-        send_message(repr(e))
+        with group_scope(group_id):
+            print(f"[DEBUG] {group_id}: {sync_calendar()}")
+    except (NoAuthenticationToken, NoGroupID, SheetException) as e:
+        # Not set up yet; nothing to sync
+        print(f"[DEBUG] Skipping calendar sync for {group_id}: {e}")
+
+
+def resync_calendar_on_change(group_id: str, changes: "ChangeSet"):
+    """Sheet subscriber: sync a group's calendar as soon as a refresh changes an upcoming meeting,
+    instead of waiting for the hourly job."""
+    from jobs import submit
+    now = datetime.now()
+    touched = changes.added + changes.removed + [event for pair in changes.modified for event in pair]
+    if not any(event.day is not None and event.day >= now for event in touched):
+        return
+    try:
+        submit(sync_calendar_quietly, group_id)
+    except JobQueueFull:
+        print(f"[ERROR] Job queue full; {group_id}'s calendar waits for its hourly sync")
 
-    group_id = get_group_id()
 
-    url = f"https://api.groupme.com/v3/conversations/{group_id}/events/create"
-    headers = {"X-Access-Token": token}
-
-    eastern = timezone("America/New_York")
-    # Combine date and time
-    start_at = event.date()
-    if event.event_time:
-        time_obj = datetime.strptime(event.event_time, "%I:%M %p").time()
-        start_at = start_at.replace(hour=time_obj.hour, minute=time_obj.minute)
-
-    start_at = start_at.astimezone(eastern)
-    end_at = (start_at + timedelta(hours=2))
-
-    payload: Dict[str, str | int | bool | Dict[str, str]] = {
-        "name": f"{event.date_str} – Small Group ft. {event.leader}",
-        "start_at": start_at.isoformat(),
-        "end_at": end_at.isoformat(),
-        "timezone": "America/New_York",
-        "description": event.notes,
-        "is_all_day": False,
-        "location": {"name": event.location_display}
-    }
-
-    resp = post(url, headers=headers, json=payload)
-    if resp.ok:
-        print(f"Event '{payload['name']}' created successfully.")
-    else:
-        print(f"Failed to create event: {resp.status_code} {resp.text}")
+def prune_old_records():
+    prune_job_runs(int(time()) - JOB_RUN_RETENTION)
+    prune_old_deliveries()
+    prune_oauth_states()